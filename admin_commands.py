@@ -12,10 +12,15 @@ from pyrogram.handlers import MessageHandler
 from pyrogram.errors import FloodWait, UserIsBlocked, PeerIdInvalid
 import db
 import utils
+import cache
+import backup
 from datetime import datetime
 
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
 
+# Groups per /grouplist message (keeps each page under Telegram's 4096 chars)
+GROUPLIST_PAGE_SIZE = 40
+
 async def is_authorized_admin(user_id: int) -> bool:
     """Check if user is owner or bot admin"""
     if user_id == OWNER_ID:
@@ -42,11 +47,10 @@ async def broadcast_handler(client: Client, message: Message):
     
     broadcast_msg = message.reply_to_message
     
-    # Get all users and groups
-    users = await db.get_all_users()
-    groups = await db.get_all_groups()
-    
-    total = len(users) + len(groups)
+    # Stream users and groups page by page; totals come from maintained counters
+    await db.flush_pending_writes()
+    total = await db.get_counter("total_users") + await db.get_counter("total_groups")
+    done = 0
     success = 0
     failed = 0
     
@@ -58,18 +62,19 @@ async def broadcast_handler(client: Client, message: Message):
     )
     
     # Broadcast to users
-    for idx, user in enumerate(users):
+    async for user in db.iter_users():
+        done += 1
         try:
             await broadcast_msg.copy(user['uid'])
             success += 1
             await asyncio.sleep(0.35)  # Rate limit delay
             
             # Update status every 10 messages
-            if (idx + 1) % 10 == 0:
+            if done % 10 == 0:
                 await status_msg.edit_text(
                     f"📢 **Broadcasting...**\n\n"
                     f"Total targets: {total}\n"
-                    f"Progress: {idx + 1}/{total}\n"
+                    f"Progress: {done}/{total}\n"
                     f"✅ Success: {success} | ❌ Failed: {failed}"
                 )
         
@@ -89,18 +94,19 @@ async def broadcast_handler(client: Client, message: Message):
             failed += 1
     
     # Broadcast to groups
-    for idx, group in enumerate(groups):
+    async for group in db.iter_groups():
+        done += 1
         try:
             await broadcast_msg.copy(group['gid'])
             success += 1
             await asyncio.sleep(0.35)
             
             # Update status
-            if (idx + 1) % 10 == 0:
+            if done % 10 == 0:
                 await status_msg.edit_text(
                     f"📢 **Broadcasting...**\n\n"
                     f"Total targets: {total}\n"
-                    f"Progress: {len(users) + idx + 1}/{total}\n"
+                    f"Progress: {done}/{total}\n"
                     f"✅ Success: {success} | ❌ Failed: {failed}"
                 )
         
@@ -117,7 +123,7 @@ async def broadcast_handler(client: Client, message: Message):
             failed += 1
     
     # Final status
-    final_text = utils.format_broadcast_stats(total, success, failed)
+    final_text = utils.format_broadcast_stats(done, success, failed)
     await status_msg.edit_text(final_text)
     
     # Log
@@ -248,12 +254,18 @@ async def grouplist_handler(client: Client, message: Message):
         await message.reply_text("❌ Unauthorized.")
         return
     
-    groups = await db.get_all_groups()
-    
-    # Format list
-    group_list_text = utils.format_group_list(groups)
-    
-    await message.reply_text(group_list_text)
+    # Stream groups and send the list in message-sized pages
+    page = []
+    index = 1
+    async for group in db.iter_groups(("gid", "title", "username", "chat_on")):
+        page.append(group)
+        if len(page) == GROUPLIST_PAGE_SIZE:
+            await message.reply_text(utils.format_group_list(page, start=index))
+            index += len(page)
+            page = []
+    
+    if page or index == 1:
+        await message.reply_text(utils.format_group_list(page, start=index))
     await db.log_usage(message.from_user.id, cmd="/grouplist")
 
 async def stats_handler(client: Client, message: Message):
@@ -266,16 +278,45 @@ async def stats_handler(client: Client, message: Message):
     
     # Get stats
     stats = await db.get_stats()
+    stats["caches"] = cache.get_all_stats()
+    from apiclient import api_client
+    from spool import spool
+    stats["api"] = api_client.stats()
+    downloads = spool.stats()
+    stats["api"]["downloads"] = (f"{downloads['downloads']} ({downloads['spooled']} spooled), "
+                                 f"{downloads['in_use']} held ({downloads['in_memory']} in memory), "
+                                 f"{downloads['used_kb']} KB held now, "
+                                 f"{downloads['evicted']} evicted, {downloads['quota_waits']} quota waits")
     
-    # Calculate uptime (from bot start time, passed from main)
-    uptime = utils.calculate_uptime(message.from_user.id)  # This needs to be fixed
+    # Calculate uptime
+    uptime = utils.calculate_uptime(utils.BOT_START_TIME)
     
     # Format stats
-    stats_text = utils.format_stats_message(stats, "Runtime")
+    stats_text = utils.format_stats_message(stats, uptime)
     
     await message.reply_text(stats_text)
     await db.log_usage(message.from_user.id, message.chat.id if message.chat.type != "private" else None, "/stats")
 
+async def rebuildstats_handler(client: Client, message: Message):
+    """
+    Rebuild stats rollup tables from usage logs
+    Usage: /rebuildstats
+    """
+    # Check authorization
+    if not await is_authorized_admin(message.from_user.id):
+        await message.reply_text("❌ Unauthorized.")
+        return
+    
+    status_msg = await message.reply_text("🔄 Stats rebuild हो रहे हैं... | Rebuilding stats...")
+    
+    try:
+        await db.rebuild_stats_rollups()
+        await status_msg.edit_text("✅ Stats rollups rebuilt from usage logs.")
+        await db.log_usage(message.from_user.id, cmd="/rebuildstats")
+    
+    except Exception as e:
+        await status_msg.edit_text(f"❌ Error: {str(e)}")
+
 async def refresh_handler(client: Client, message: Message):
     """Refresh bot (re-init API client and reload config)"""
     # Check authorization
@@ -298,6 +339,7 @@ async def refresh_handler(client: Client, message: Message):
     from apiclient import api_client
     await api_client.close_session()
     await api_client.init_session()
+    await api_client.warm_up()
     
     await message.reply_text(
         "✅ **Bot Refreshed!**\n\n"
@@ -401,6 +443,7 @@ async def removefjoin_handler(client: Client, message: Message):
 async def dumpdb_handler(client: Client, message: Message):
     """
     Dump database file (OWNER only)
+    Usage: /dumpdb (latest snapshot) or /dumpdb now (fresh snapshot)
     """
     # Only owner can dump database
     if message.from_user.id != OWNER_ID:
@@ -408,10 +451,21 @@ async def dumpdb_handler(client: Client, message: Message):
         return
     
     try:
-        # Send database file
+        # Send the latest consistent snapshot, never the hot database file
+        args = message.text.split()
+        fresh = len(args) > 1 and args[1].lower() == "now"
+        snapshot = None if fresh else backup.latest_snapshot()
+        if not snapshot:
+            status_msg = await message.reply_text("💾 Backup बन रहा है... | Creating backup...")
+            snapshot = await backup.create_snapshot()
+            await status_msg.delete()
+        
+        taken_at = datetime.fromtimestamp(os.path.getmtime(snapshot)).strftime("%Y-%m-%d %H:%M:%S")
+        
+        # Send database snapshot
         await message.reply_document(
-            document="bot_data.db",
-            caption="📊 Database backup\n\n— NEET AI Bot"
+            document=snapshot,
+            caption=f"📊 Database backup ({taken_at})\n\n— NEET AI Bot"
         )
         
         await db.log_usage(message.from_user.id, cmd="/dumpdb")
@@ -427,6 +481,7 @@ def register_admin_handlers(app: Client):
     app.add_handler(MessageHandler(adminlist_handler, filters.command("adminlist")))
     app.add_handler(MessageHandler(grouplist_handler, filters.command("grouplist")))
     app.add_handler(MessageHandler(stats_handler, filters.command("stats")))
+    app.add_handler(MessageHandler(rebuildstats_handler, filters.command("rebuildstats")))
     app.add_handler(MessageHandler(refresh_handler, filters.command("refresh")))
     app.add_handler(MessageHandler(fjoin_handler, filters.command("fjoin")))
     app.add_handler(MessageHandler(removefjoin_handler, filters.command("removefjoin")))
@@ -0,0 +1,292 @@
+"""
+Answer cache for APIClient.get_answer
+Students keep sending the same questions; repeats are answered from memory
+or from SQLite (db.answer_cache) instead of the website API, and close
+rephrasings from the near-duplicate index (similarity.py).
+"""
+
+import os
+import json
+import zlib
+import asyncio
+import hashlib
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+import cache
+from cache import TTLCache
+import db
+from similarity import (SimilarityIndex, write_snapshot, SIMILARITY_ENABLED,
+                        SIMILARITY_INDEX_PATH, SIMILARITY_SAVE_INTERVAL)
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") != "0"
+ANSWER_MEMORY_SIZE = int(os.getenv("ANSWER_MEMORY_SIZE", "5000"))
+ANSWER_MEMORY_TTL = float(os.getenv("ANSWER_MEMORY_TTL", "3600"))
+
+# Sentence punctuation that does not change what is being asked
+# (Devanagari danda/double danda included). Math symbols, brackets, '-',
+# '/', ':' and decimal points are kept: "2+3" and "2*3" are different questions.
+_DROP_CHARS = set("?!,;\"'`“”‘’«»¿¡…।॥")
+
+def normalize_question(text: str) -> str:
+    """
+    Canonical form of a question for cache lookups
+    NFKC + casefold, Devanagari digits -> ASCII, zero-width joiners and
+    emoji dropped, sentence punctuation and whitespace collapsed
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    chars = []
+    for i, ch in enumerate(text):
+        category = unicodedata.category(ch)
+        if category == "Nd":
+            chars.append(str(unicodedata.digit(ch)))
+        elif category == "Cf" or "\ufe00" <= ch <= "\ufe0f":
+            # ZWJ/ZWNJ and variation selectors only change how text renders
+            continue
+        elif ch in _DROP_CHARS or category in ("So", "Cc") or ch.isspace():
+            chars.append(" ")
+        elif ch == "." and not (0 < i < len(text) - 1 and text[i - 1].isdigit() and text[i + 1].isdigit()):
+            chars.append(" ")
+        else:
+            chars.append(ch)
+    return " ".join("".join(chars).split())
+
+def cache_key(question: str, mode: str) -> Tuple[str, str]:
+    """(key, normalized question); the key is empty when there is nothing to cache on"""
+    normalized = normalize_question(question)
+    if not normalized:
+        return "", normalized
+    return hashlib.sha1(f"{mode}\n{normalized}".encode()).hexdigest(), normalized
+
+def is_cacheable(result: Dict[str, Any]) -> bool:
+    """Only real, successful answers; never errors or mock fallbacks"""
+    return bool(result.get("success")) and not result.get("fallback")
+
+class AnswerCache:
+    """In-memory LRU in front of the persistent SQLite tier and the near-duplicate index"""
+    
+    def __init__(self):
+        self._memory = TTLCache(ANSWER_MEMORY_SIZE, ANSWER_MEMORY_TTL)
+        self.index = SimilarityIndex()
+        # Answers stored while the index is still loading: (normalized, mode, key)
+        self._index_backlog: Optional[List[tuple]] = None
+        self._index_dirty = False
+        self._save_task: Optional[asyncio.Task] = None
+        self._merge_task: Optional[asyncio.Task] = None
+        self._merge_lock = asyncio.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stores = 0
+        cache.register("answers", self)
+    
+    async def get(self, question: str, mode: str) -> Optional[Dict[str, Any]]:
+        """Cached answer for the question, or None"""
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        key, normalized = cache_key(question, mode)
+        if not key:
+            return None
+        
+        result = self._memory.get(key)
+        if result is not None:
+            self.memory_hits += 1
+            db.touch_cached_answer(key)
+            return dict(result)
+        
+        result = await self._load(key)
+        if result is not None:
+            self.disk_hits += 1
+            self._memory.set(key, result)
+            db.touch_cached_answer(key)
+            return dict(result)
+        
+        match = self.index.query(normalized, mode) if SIMILARITY_ENABLED else None
+        if match is not None:
+            similar_key, _ = match
+            result = self._memory.get(similar_key)
+            if result is None:
+                result = await self._load(similar_key)
+            if result is not None:
+                self.near_hits += 1
+                # Only the original question is stored; the rephrasing is
+                # remembered in memory
+                self._memory.set(key, result)
+                db.touch_cached_answer(similar_key)
+                return dict(result)
+        
+        self.misses += 1
+        return None
+    
+    async def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        """Answer from the persistent tier, or None"""
+        payload = await db.get_cached_answer(key)
+        if payload is None:
+            return None
+        try:
+            return json.loads(zlib.decompress(payload))
+        except (zlib.error, ValueError) as e:
+            print(f"⚠️ Unreadable cached answer {key}: {e}")
+            return None
+    
+    def put(self, question: str, mode: str, result: Dict[str, Any]):
+        """Remember a successful answer in both tiers"""
+        if not ANSWER_CACHE_ENABLED or not is_cacheable(result):
+            return
+        key, normalized = cache_key(question, mode)
+        if not key:
+            return
+        
+        self._memory.set(key, dict(result))
+        payload = zlib.compress(json.dumps(result, ensure_ascii=False).encode(), 6)
+        db.store_cached_answer(key, mode, normalized, payload)
+        self.stores += 1
+        
+        if SIMILARITY_ENABLED:
+            if self._index_backlog is not None:
+                self._index_backlog.append((normalized, mode, key))
+            elif self.index.add(normalized, mode, key):
+                self._index_dirty = True
+                if self.index.merge_due() and not self._merge_lock.locked():
+                    self._merge_task = asyncio.create_task(self._merge_index_safely())
+    
+    # ---------- near-duplicate index lifecycle ----------
+    
+    async def merge_index(self):
+        """
+        Merge the index's pending inserts into its band tables in a worker
+        thread; lookups and inserts carry on meanwhile
+        """
+        async with self._merge_lock:
+            index = self.index
+            if not index.pending():
+                return
+            index.begin_merge()
+            try:
+                tables = await asyncio.to_thread(index.merged_tables)
+            except BaseException:
+                index.abort_merge()
+                raise
+            index.finish_merge(tables)
+    
+    async def _merge_index_safely(self):
+        try:
+            await self.merge_index()
+        except Exception as e:
+            print(f"❌ Similarity index merge failed: {e}")
+    
+    async def _build_index(self, index: SimilarityIndex, since: float) -> int:
+        """
+        Add answers stored after `since` to an index that is not in use yet
+        Rows are read on the event loop a page at a time; sketching and the
+        final merge run in a worker thread
+        """
+        added = 0
+        page = []
+        async for row in db.iter_cached_answers(since):
+            page.append((row["question"], row["mode"], row["key"]))
+            if len(page) >= db.PAGE_SIZE:
+                added += await asyncio.to_thread(index.add_many, page)
+                page = []
+        if page:
+            added += await asyncio.to_thread(index.add_many, page)
+        await asyncio.to_thread(index.merge)
+        return added
+    
+    async def load_index(self, rebuild: bool = False):
+        """
+        Load the saved index and catch up with answers stored since it was
+        saved; rebuild from the answer_cache table when missing or stale
+        """
+        if not SIMILARITY_ENABLED:
+            return
+        self._index_backlog = []
+        try:
+            index = None if rebuild else await asyncio.to_thread(SimilarityIndex.load, SIMILARITY_INDEX_PATH)
+            since = index.saved_at if index else 0.0
+            if index is None:
+                index = SimilarityIndex()
+            added = await self._build_index(index, since)
+        except Exception:
+            self._index_backlog = None
+            raise
+        
+        for normalized, mode, key in self._index_backlog:
+            index.add(normalized, mode, key)
+        self._index_backlog = None
+        self.index = index
+        self._index_dirty = self._index_dirty or added > 0 or rebuild
+        print(f"🔎 Similarity index ready: {len(index)} questions ({'rebuilt' if since == 0 else f'{added} new'})")
+    
+    async def save_index(self):
+        """Write the index to SIMILARITY_INDEX_PATH if it changed"""
+        if not SIMILARITY_ENABLED or not self._index_dirty or self._index_backlog is not None:
+            return
+        await self.merge_index()
+        parts = self.index.snapshot()
+        self._index_dirty = False
+        try:
+            await asyncio.to_thread(write_snapshot, parts, SIMILARITY_INDEX_PATH)
+        except OSError:
+            self._index_dirty = True
+            raise
+    
+    async def _index_loop(self):
+        try:
+            await self.load_index()
+        except Exception as e:
+            print(f"❌ Similarity index load failed: {e}")
+        
+        # SIMILARITY_SAVE_INTERVAL = 0: only save on shutdown
+        while SIMILARITY_SAVE_INTERVAL > 0:
+            await asyncio.sleep(SIMILARITY_SAVE_INTERVAL)
+            try:
+                # Entries are never removed, so rebuild once the index has
+                # grown well past what the answer_cache table still holds
+                if len(self.index) > 2 * db.ANSWER_CACHE_MAX_ROWS:
+                    await self.load_index(rebuild=True)
+                await self.save_index()
+            except Exception as e:
+                print(f"❌ Similarity index save failed: {e}")
+    
+    def start(self):
+        """
+        Load the near-duplicate index in the background and save it
+        periodically (after db.init_db); exact lookups work meanwhile
+        """
+        if SIMILARITY_ENABLED and self._save_task is None:
+            self._save_task = asyncio.create_task(self._index_loop())
+    
+    async def stop(self):
+        """Stop periodic saves and save the index one last time"""
+        if self._save_task is not None:
+            self._save_task.cancel()
+            try:
+                await self._save_task
+            except asyncio.CancelledError:
+                pass
+            self._save_task = None
+        try:
+            await self.save_index()
+        except Exception as e:
+            print(f"❌ Final similarity index save failed: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Counters for /stats"""
+        hits = self.memory_hits + self.disk_hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            "size": db.answer_cache_rows(),
+            "memory_size": len(self._memory),
+            "similar_entries": len(self.index),
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": (hits / lookups) if lookups else 0.0
+        }
+
+# Global answer cache instance
+answer_cache = AnswerCache()
@@ -1,46 +1,444 @@
 """
 API Client wrapper for website API calls
-Handles retry logic, error handling, and fallback to mock API
+Handles retries with backoff and a circuit breaker, hedged requests with
+latency-adaptive deadlines, an adaptive concurrency limit with a priority
+queue, optional micro-batching, answer caching, coalescing of identical in-flight requests, a tuned
+and pre-warmed connection pool and fallback to mock API
 """
 
 import os
+import heapq
 import aiohttp
 import asyncio
-from typing import Dict, Any, Optional
+import itertools
+import json
+from contextlib import asynccontextmanager, nullcontext
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Set, Tuple
 import mock_api
+import images
+from answer_cache import answer_cache, cache_key
+from image_cache import image_cache
+from images import Photo, photo_size
+from resilience import RetryPolicy, CircuitBreaker, BackendError, LatencyTracker
+from spool import spool
 
 # Environment variables
 WEBSITE_API_URL = os.getenv("WEBSITE_API_URL", "")
 WEBSITE_API_KEY = os.getenv("WEBSITE_API_KEY", "")
 USE_MOCK_API = not WEBSITE_API_URL or WEBSITE_API_URL == ""
 
+# Connection pool
+API_POOL_LIMIT = int(os.getenv("API_POOL_LIMIT", "100"))
+API_POOL_LIMIT_PER_HOST = int(os.getenv("API_POOL_LIMIT_PER_HOST", "50"))
+API_KEEPALIVE_TIMEOUT = float(os.getenv("API_KEEPALIVE_TIMEOUT", "30"))
+API_DNS_CACHE_TTL = int(os.getenv("API_DNS_CACHE_TTL", "300"))
+# Deflate request bodies (only if the website API accepts Content-Encoding)
+API_COMPRESS_REQUESTS = os.getenv("API_COMPRESS_REQUESTS", "0") == "1"
+# Connections opened at startup and /refresh, re-warmed every interval (0 = never)
+API_WARMUP_CONNECTIONS = int(os.getenv("API_WARMUP_CONNECTIONS", "4"))
+API_WARMUP_INTERVAL = float(os.getenv("API_WARMUP_INTERVAL", "25"))
+
+# Built once instead of per request
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "10"))
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(
+    total=float(os.getenv("API_TIMEOUT", "30")),
+    connect=API_CONNECT_TIMEOUT
+)
+# Streamed answers have no total cap: the first-content deadline and
+# API_STREAM_IDLE_TIMEOUT between chunks bound them instead
+STREAM_TIMEOUT = aiohttp.ClientTimeout(
+    total=None,
+    connect=API_CONNECT_TIMEOUT,
+    sock_connect=API_CONNECT_TIMEOUT
+)
+WARMUP_TIMEOUT = aiohttp.ClientTimeout(total=5)
+
+# Per-attempt deadline = observed p99 x factor, clamped to [min, API_TIMEOUT]
+API_DEADLINE_FACTOR = float(os.getenv("API_DEADLINE_FACTOR", "2.0"))
+API_DEADLINE_MIN = float(os.getenv("API_DEADLINE_MIN", "5"))
+# A duplicate request is sent once the first one is slower than the observed
+# p95. Hedges per request on average (capped at 1: never more than double load)
+API_HEDGE_ENABLED = os.getenv("API_HEDGE_ENABLED", "1") != "0"
+API_HEDGE_MAX_RATE = min(1.0, float(os.getenv("API_HEDGE_MAX_RATE", "0.1")))
+HEDGE_BURST = 10
+
+# Request priorities (lower goes first)
+PRIORITY_ADMIN = 0
+PRIORITY_PRIVATE = 1
+PRIORITY_SOL = 2
+PRIORITY_PASSIVE = 3
+
+# AIMD concurrency limit for backend requests
+API_CONCURRENCY_INITIAL = int(os.getenv("API_CONCURRENCY_INITIAL", "8"))
+API_CONCURRENCY_MIN = int(os.getenv("API_CONCURRENCY_MIN", "2"))
+API_CONCURRENCY_MAX = int(os.getenv("API_CONCURRENCY_MAX", "64"))
+API_CONCURRENCY_BACKOFF = float(os.getenv("API_CONCURRENCY_BACKOFF", "0.7"))
+# Seconds a request may wait in the queue, per priority (admin, private, /sol, passive)
+API_QUEUE_DEADLINES = tuple(float(x) for x in os.getenv("API_QUEUE_DEADLINES", "30,20,10,2").split(","))
+if len(API_QUEUE_DEADLINES) != PRIORITY_PASSIVE + 1:
+    raise ValueError(f"API_QUEUE_DEADLINES needs {PRIORITY_PASSIVE + 1} comma-separated seconds "
+                     f"(admin, private, /sol, passive), got {len(API_QUEUE_DEADLINES)}")
+
+# Micro-batching (opt-in): questions arriving within the window go out as
+# one request to the batch endpoint
+API_BATCH_ENABLED = os.getenv("API_BATCH_ENABLED", "0") == "1"
+API_BATCH_URL = os.getenv("API_BATCH_URL") or (WEBSITE_API_URL.rstrip("/") + "/batch" if WEBSITE_API_URL else "")
+API_BATCH_WINDOW = float(os.getenv("API_BATCH_WINDOW_MS", "10")) / 1000
+API_BATCH_MAX_SIZE = int(os.getenv("API_BATCH_MAX_SIZE", "16"))
+# Seconds to stay on single requests after the batch endpoint turned out to be missing
+API_BATCH_COOLDOWN = float(os.getenv("API_BATCH_COOLDOWN", "300"))
+
+# Multipart endpoint for photo questions (fields: uid, mode, image)
+API_IMAGE_URL = os.getenv("API_IMAGE_URL") or WEBSITE_API_URL
+
+# Streaming (opt-in): ask for the answer as a text/event-stream (or NDJSON)
+# so handlers can show it while it is being written
+API_STREAM_ENABLED = os.getenv("API_STREAM_ENABLED", "0") == "1"
+# Seconds without a new chunk before a streamed answer is given up
+API_STREAM_IDLE_TIMEOUT = float(os.getenv("API_STREAM_IDLE_TIMEOUT", "15"))
+
+def describe_error(error: BaseException) -> str:
+    """Readable error text (asyncio.TimeoutError has an empty message)"""
+    return str(error) or type(error).__name__
+
+class PoolStats:
+    """Connection pool counters fed by aiohttp tracing"""
+    
+    def __init__(self):
+        self.created = 0
+        self.reused = 0
+        self.queued = 0
+        self.queue_waits = 0
+        self.queue_wait_time = 0.0
+        self.max_queued = 0
+    
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_queued_start.append(self._queued_start)
+        trace.on_connection_queued_end.append(self._queued_end)
+        trace.on_connection_create_end.append(self._created)
+        trace.on_connection_reuseconn.append(self._reused)
+        return trace
+    
+    async def _queued_start(self, session, ctx, params):
+        ctx.queued_at = asyncio.get_running_loop().time()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+    
+    async def _queued_end(self, session, ctx, params):
+        self.queued -= 1
+        self.queue_waits += 1
+        self.queue_wait_time += asyncio.get_running_loop().time() - ctx.queued_at
+    
+    async def _created(self, session, ctx, params):
+        self.created += 1
+    
+    async def _reused(self, session, ctx, params):
+        self.reused += 1
+
+class Overloaded(Exception):
+    """A request waited in the queue longer than its priority allows"""
+
+class Ticket:
+    """Priority of one backend request; coalesced callers may raise it while it waits"""
+    
+    def __init__(self, priority: int):
+        self.priority = priority
+        self._limiter: Optional["AdaptiveLimiter"] = None
+        self._future: Optional[asyncio.Future] = None
+    
+    def raise_priority(self, priority: int):
+        if priority < self.priority:
+            self.priority = priority
+            if self._future is not None and not self._future.done():
+                self._limiter._push(self)
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit with a priority queue in front of it
+    Each success raises the limit by 1/limit (about +1 per full round);
+    a timeout, 5xx or connection error cuts it by API_CONCURRENCY_BACKOFF
+    (at most once per second). Queued requests are admitted by priority and
+    shed once they pass their priority's queue deadline.
+    """
+    
+    def __init__(self, initial: int = API_CONCURRENCY_INITIAL, minimum: int = API_CONCURRENCY_MIN,
+                 maximum: int = API_CONCURRENCY_MAX, backoff: float = API_CONCURRENCY_BACKOFF):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.in_use = 0
+        # (priority, seq, ticket, future); stale entries are skipped on pop
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+        self._last_decrease = 0.0
+        self.queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.wait_time = 0.0
+        self.shed = [0] * len(API_QUEUE_DEADLINES)
+    
+    def _push(self, ticket: Ticket):
+        heapq.heappush(self._queue, (ticket.priority, next(self._seq), ticket, ticket._future))
+    
+    def _wake(self):
+        while self._queue and self.in_use < int(self.limit):
+            priority, _, ticket, future = heapq.heappop(self._queue)
+            if future.done() or priority != ticket.priority:
+                continue
+            self.in_use += 1
+            future.set_result(None)
+    
+    async def acquire(self, ticket: Ticket):
+        """Wait for a slot; raises Overloaded when the queue deadline passes"""
+        loop = asyncio.get_running_loop()
+        if self.in_use < int(self.limit) and not self.queued:
+            self.in_use += 1
+            self.admitted += 1
+            return
+        
+        future = loop.create_future()
+        ticket._limiter, ticket._future = self, future
+        self._push(ticket)
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        enqueued = loop.time()
+        try:
+            while not future.done():
+                # Re-read the deadline: the ticket may have been promoted
+                remaining = enqueued + API_QUEUE_DEADLINES[ticket.priority] - loop.time()
+                if remaining <= 0:
+                    future.cancel()
+                    break
+                await asyncio.wait({future}, timeout=remaining)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller went away: pass the slot on
+                self.release(None)
+            future.cancel()
+            raise
+        finally:
+            self.queued -= 1
+            ticket._future = None
+        
+        if future.cancelled():
+            self.shed[ticket.priority] += 1
+            raise Overloaded(f"queued {loop.time() - enqueued:.1f}s at priority {ticket.priority}")
+        self.admitted += 1
+        self.wait_time += loop.time() - enqueued
+    
+    def release(self, ok: Optional[bool]):
+        """Free a slot; ok=True/False adjusts the limit, None leaves it alone"""
+        self.in_use -= 1
+        now = asyncio.get_running_loop().time()
+        if ok:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        elif ok is False and now - self._last_decrease >= 1.0:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+            self._last_decrease = now
+        self._wake()
+    
+    @asynccontextmanager
+    async def slot(self, ticket: Ticket):
+        await self.acquire(ticket)
+        ok = None
+        try:
+            yield
+            ok = True
+        except Exception as e:
+            ok = False if RetryPolicy.is_retryable(e) else None
+            raise
+        finally:
+            self.release(ok)
+
+class BatchItemFailed(Exception):
+    """The batch response had no usable result for this question"""
+
+class MicroBatcher:
+    """
+    Collects questions for API_BATCH_WINDOW (or until API_BATCH_MAX_SIZE)
+    and sends them as one batch request, fanning results back out
+    Batch protocol: {"items": [{"id", "q", "uid", "mode"}, ...]}
+                 -> {"results": [{"id", ...answer...}, ...]}
+    Items that fail (missing, or carrying "error") raise BatchItemFailed so
+    the caller can ask for them on their own. A batch that fails as a whole
+    with a retryable error counts once on the breaker and its callers fall
+    back to mock instead of sending every question again.
+    """
+    
+    def __init__(self, client: "APIClient"):
+        self.enabled = API_BATCH_ENABLED and bool(API_BATCH_URL)
+        self._client = client
+        # (payload, ticket, future)
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._dispatching: Set[asyncio.Task] = set()
+        self.disabled_until = 0.0
+        self.batches = 0
+        self.items = 0
+        self.item_failures = 0
+        self.batch_failures = 0
+    
+    def available(self) -> bool:
+        return self.enabled and asyncio.get_running_loop().time() >= self.disabled_until
+    
+    @staticmethod
+    def endpoint_missing(error: BaseException) -> bool:
+        """The backend has no batch endpoint (single requests still work)"""
+        return isinstance(error, BackendError) and error.status in (404, 405, 501)
+    
+    async def submit(self, payload: Dict[str, Any], ticket: Ticket) -> Dict[str, Any]:
+        """Queue one question for the next batch and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((payload, ticket, future))
+        if len(self._pending) >= API_BATCH_MAX_SIZE:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(API_BATCH_WINDOW, self._flush)
+        return await future
+    
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatching.add(task)
+            task.add_done_callback(self._dispatching.discard)
+    
+    async def _dispatch(self, batch: List[tuple]):
+        client = self._client
+        # The batch is one backend call: one slot, at its most urgent priority
+        ticket = Ticket(min(item[1].priority for item in batch))
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            async with client.limiter.slot(ticket):
+                results = await client._post_batch([item[0] for item in batch])
+        except Exception as e:
+            if not isinstance(e, Overloaded):
+                self.batch_failures += 1
+                if self.endpoint_missing(e):
+                    self.disabled_until = asyncio.get_running_loop().time() + API_BATCH_COOLDOWN
+                    print(f"⚠️ Batch endpoint unavailable ({e}), single requests for {API_BATCH_COOLDOWN:.0f}s")
+                elif RetryPolicy.is_retryable(e):
+                    client.breaker.record_failure()
+                    print(f"❌ Batch of {len(batch)} failed: {describe_error(e)}; falling back to mock API")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        client.breaker.record_success()
+        by_id = {str(result.get("id")): result for result in results if isinstance(result, dict)}
+        for i, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            result = by_id.get(str(i))
+            if result is None or result.get("error"):
+                self.item_failures += 1
+                future.set_exception(BatchItemFailed(result.get("error") if result else "missing from batch"))
+            else:
+                result.pop("id", None)
+                future.set_result(result)
+
 class APIClient:
     """Website API client with retry logic and error handling"""
     
     def __init__(self):
         self.session: Optional[aiohttp.ClientSession] = None
         self.use_mock = USE_MOCK_API
+        # cache key -> shared backend request for that question and its priority
+        self._in_flight: Dict[str, Tuple[asyncio.Task, Ticket]] = {}
+        self.backend_calls = 0
+        self.coalesced = 0
+        self.pool = PoolStats()
+        self.retry_policy = RetryPolicy()
+        self.breaker = CircuitBreaker("answers")
+        # mode -> recent latencies
+        self.latency: Dict[str, LatencyTracker] = {}
+        self._hedge_tokens = 0.0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.limiter = AdaptiveLimiter()
+        self.image_uploads = 0
+        self.image_bytes_in = 0
+        self.image_bytes_out = 0
+        self.batcher = MicroBatcher(self)
+        self._warm_task: Optional[asyncio.Task] = None
     
     async def init_session(self):
         """Initialize aiohttp session"""
         if not self.session:
-            self.session = aiohttp.ClientSession()
+            connector = aiohttp.TCPConnector(
+                limit=API_POOL_LIMIT,
+                limit_per_host=API_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=API_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=API_DNS_CACHE_TTL
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=REQUEST_TIMEOUT,
+                trace_configs=[self.pool.trace_config()]
+            )
     
     async def close_session(self):
         """Close aiohttp session"""
+        if self._warm_task:
+            self._warm_task.cancel()
+            self._warm_task = None
         if self.session:
             await self.session.close()
             self.session = None
     
-    async def get_answer(self, question: str, uid: int, mode: str = "short", retry_count: int = 0) -> Dict[str, Any]:
+    async def warm_up(self, connections: int = API_WARMUP_CONNECTIONS) -> int:
         """
-        Get answer from website API with retry logic
+        Open `connections` pooled connections to the website API (DNS, TCP and
+        TLS done up front) and keep them warm every API_WARMUP_INTERVAL seconds
+        Returns how many connections answered
+        """
+        if self.use_mock or connections <= 0:
+            return 0
+        await self.init_session()
+        
+        async def open_one() -> bool:
+            # OPTIONS, not HEAD: aiohttp does not pool connections after HEAD
+            try:
+                async with self.session.options(WEBSITE_API_URL, timeout=WARMUP_TIMEOUT, allow_redirects=False) as response:
+                    await response.read()
+                    return True
+            except Exception:
+                return False
+        
+        # Concurrent requests, so each one needs its own connection
+        opened = sum(await asyncio.gather(*(open_one() for _ in range(connections))))
+        
+        if API_WARMUP_INTERVAL > 0 and self._warm_task is None:
+            self._warm_task = asyncio.create_task(self._warm_loop(connections))
+        return opened
+    
+    async def _warm_loop(self, connections: int):
+        while True:
+            await asyncio.sleep(API_WARMUP_INTERVAL)
+            await self.warm_up(connections)
+    
+    async def get_answer(self, question: str, uid: int, mode: str = "short",
+                         priority: int = PRIORITY_PRIVATE,
+                         on_progress: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Get answer from the answer cache or the website API
         
         Args:
             question: Question text
             uid: User ID
             mode: "short" or "detailed"
-            retry_count: Current retry attempt
+            priority: PRIORITY_* constant; decides queue order under load
+            on_progress: called with the answer text so far while it streams
+                in (API_STREAM_ENABLED); not called for cached answers or
+                for callers joining a request already in flight
         
         Returns:
             Dict with answer data or error
@@ -50,88 +448,447 @@ class APIClient:
             print(f"🔄 Using mock API for question: {question[:50]}...")
             return await mock_api.get_mock_answer(question, uid, mode)
         
-        # Initialize session if needed
-        await self.init_session()
+        cached = await answer_cache.get(question, mode)
+        if cached is not None:
+            return cached
         
-        # Prepare request
-        headers = {}
-        if WEBSITE_API_KEY:
-            headers["Authorization"] = f"Bearer {WEBSITE_API_KEY}"
+        # Single flight: identical questions asked while one is already on
+        # its way to the API wait for that request instead of sending another
+        key, _ = cache_key(question, mode)
+        flight = self._in_flight.get(key) if key else None
+        if flight is None:
+            ticket = Ticket(priority)
+            task = asyncio.create_task(self._fetch_and_cache(question, uid, mode, ticket, on_progress))
+            if key:
+                self._in_flight[key] = (task, ticket)
+                task.add_done_callback(lambda done: self._forget_in_flight(key, done))
+        else:
+            task, ticket = flight
+            ticket.raise_priority(priority)
+            self.coalesced += 1
         
+        # shield: a waiter being cancelled must not cancel the shared request
+        result = await asyncio.shield(task)
+        return dict(result)
+    
+    def _forget_in_flight(self, key: str, task: asyncio.Task):
+        flight = self._in_flight.get(key)
+        if flight is not None and flight[0] is task:
+            del self._in_flight[key]
+    
+    async def _fetch_and_cache(self, question: str, uid: int, mode: str, ticket: Ticket,
+                               on_progress: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        self.backend_calls += 1
+        result = await self._fetch_answer(question, uid, mode, ticket, on_progress)
+        answer_cache.put(question, mode, result)
+        return result
+    
+    async def _fallback_answer(self, question: str, uid: int, mode: str) -> Dict[str, Any]:
+        """Mock answer marked as a fallback so it is never cached"""
+        result = await mock_api.get_mock_answer(question, uid, mode)
+        result["fallback"] = True
+        return result
+    
+    async def _fetch_answer(self, question: str, uid: int, mode: str, ticket: Ticket,
+                            on_progress: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Ask the website API under the concurrency limit, retry policy and
+        circuit breaker, falling back to mock; shed requests get an error
+        """
+        # Prepare request
+        headers = self._headers()
         payload = {
             "q": question,
             "uid": uid,
             "mode": mode
         }
         
-        try:
-            # Make API call with timeout
-            if self.session:
-                async with self.session.post(
-                    WEBSITE_API_URL,
-                    json=payload,
-                    headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=30)
-                ) as response:
+        if on_progress is not None and API_STREAM_ENABLED and self.breaker.state == CircuitBreaker.CLOSED:
+            try:
+                async with self.limiter.slot(ticket):
+                    data = await self._stream_post(payload, headers, mode, on_progress)
+                self.breaker.record_success()
+                return data
+            except Overloaded as e:
+                print(f"🚦 Shed API request ({e})")
+                return {"success": False, "error": "overloaded"}
+            except Exception as e:
+                if isinstance(e, BackendError) and e.status < 500:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                # Ask again without streaming (with retries); the final
+                # answer replaces whatever partial text was shown
+                print(f"↩️ Streaming failed: {describe_error(e)}")
+        
+        elif self.batcher.available() and self.breaker.state == CircuitBreaker.CLOSED:
+            try:
+                return await self.batcher.submit(payload, ticket)
+            except Overloaded as e:
+                print(f"🚦 Shed API request ({e})")
+                return {"success": False, "error": "overloaded"}
+            except Exception as e:
+                if RetryPolicy.is_retryable(e) and not MicroBatcher.endpoint_missing(e):
+                    # The backend is struggling: one request per question
+                    # (with retries) would multiply the load on it
+                    return await self._fallback_answer(question, uid, mode)
+                # Fall through to a request of its own (with retries)
+                print(f"↩️ Batch failed for one question: {describe_error(e)}")
+        
+        return await self._call_backend(
+            lambda: self._hedged_post(payload, headers, mode),
+            ticket,
+            lambda: self._fallback_answer(question, uid, mode)
+        )
+    
+    async def _call_backend(self, send: Callable[[], Awaitable[Dict[str, Any]]], ticket: Ticket,
+                            fallback: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        send() under the concurrency limit, retry policy and circuit breaker;
+        fallback() once the backend is unavailable or retries are used up
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                return await fallback()
+            
+            try:
+                async with self.limiter.slot(ticket):
+                    data = await send()
+                self.breaker.record_success()
+                return data
+            except Overloaded as e:
+                print(f"🚦 Shed API request ({e})")
+                return {"success": False, "error": "overloaded"}
+            except Exception as e:
+                if isinstance(e, BackendError) and e.status < 500:
+                    # The backend answered; it just did not like this request
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                print(f"❌ API error (attempt {attempt + 1}): {describe_error(e)}")
                 
-                    if response.status == 200:
-                        data = await response.json()
-                        return data
-                    else:
-                        error_msg = f"API returned status {response.status}"
-                        print(f"❌ API Error: {error_msg}")
-                        
-                        # Retry logic with exponential backoff
-                        if retry_count < 2:
-                            wait_time = (retry_count + 1) * 2
-                            print(f"⏳ Retrying in {wait_time} seconds...")
-                            await asyncio.sleep(wait_time)
-                            return await self.get_answer(question, uid, mode, retry_count + 1)
-                        
-                        # Fallback to mock after retries
-                        print("🔄 Falling back to mock API")
-                        return await mock_api.get_mock_answer(question, uid, mode)
-            else:
-                return await mock_api.get_mock_answer(question, uid, mode)
+                delay = self.retry_policy.next_delay(e, attempt, loop.time() - started)
+                if delay is None:
+                    print("🔄 Falling back to mock API")
+                    return await fallback()
+                
+                await asyncio.sleep(delay)
+                attempt += 1
+    
+    @staticmethod
+    def _headers() -> Dict[str, str]:
+        headers = {}
+        if WEBSITE_API_KEY:
+            headers["Authorization"] = f"Bearer {WEBSITE_API_KEY}"
+        return headers
+    
+    async def _post_batch(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """One batch POST; results carry the item ids ("0", "1", ...)"""
+        await self.init_session()
+        tracker = self._latency("batch")
+        body = {"items": [dict(payload, id=str(i)) for i, payload in enumerate(payloads)]}
+        
+        async def post() -> List[Dict[str, Any]]:
+            async with self.session.post(
+                API_BATCH_URL,
+                json=body,
+                headers=self._headers(),
+                compress="deflate" if API_COMPRESS_REQUESTS else None
+            ) as response:
+                if response.status != 200:
+                    raise BackendError(response.status)
+                data = await response.json()
+                return data.get("results", [])
+        
+        return await self._timed(post(), tracker, self._deadline(tracker))
+    
+    async def _post_image(self, image: Photo, uid: int) -> Dict[str, Any]:
+        """Multipart POST of a photo question (spooled photos are streamed from their file)"""
+        await self.init_session()
+        tracker = self._latency("image")
         
+        async def post() -> Dict[str, Any]:
+            # A FormData body can only be sent once; retries build their own
+            form = aiohttp.FormData()
+            form.add_field("uid", str(uid))
+            form.add_field("mode", "short")
+            with open(image, "rb") if isinstance(image, str) else nullcontext(image) as body:
+                form.add_field("image", body, filename="photo.jpg", content_type="image/jpeg")
+                async with self.session.post(API_IMAGE_URL, data=form, headers=self._headers()) as response:
+                    if response.status != 200:
+                        raise BackendError(response.status)
+                    return await response.json()
+        
+        return await self._timed(post(), tracker, self._deadline(tracker))
+    
+    def _latency(self, mode: str) -> LatencyTracker:
+        tracker = self.latency.get(mode)
+        if tracker is None:
+            tracker = self.latency[mode] = LatencyTracker()
+        return tracker
+    
+    def _deadline(self, tracker: LatencyTracker) -> float:
+        """Per-attempt deadline from the observed p99 (API_TIMEOUT until there is data)"""
+        p99 = tracker.percentile(0.99)
+        if p99 is None:
+            return REQUEST_TIMEOUT.total
+        return min(REQUEST_TIMEOUT.total, max(API_DEADLINE_MIN, p99 * API_DEADLINE_FACTOR))
+    
+    async def _timed_post(self, payload: Dict[str, Any], headers: Dict[str, str],
+                          tracker: LatencyTracker, deadline: float) -> Dict[str, Any]:
+        return await self._timed(self._post(payload, headers), tracker, deadline)
+    
+    @staticmethod
+    async def _timed(request: Awaitable[Any], tracker: LatencyTracker, deadline: float) -> Any:
+        """Await a backend request within deadline, recording its latency"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            data = await asyncio.wait_for(request, deadline)
         except asyncio.TimeoutError:
-            print(f"⏱️ API timeout (attempt {retry_count + 1})")
-            
-            if retry_count < 2:
-                await asyncio.sleep((retry_count + 1) * 2)
-                return await self.get_answer(question, uid, mode, retry_count + 1)
-            
-            # Fallback to mock
-            return await mock_api.get_mock_answer(question, uid, mode)
+            # Record the deadline (the real latency was at least that) so the
+            # tail is not hidden by the requests we cut off
+            tracker.add(deadline)
+            raise
+        tracker.add(loop.time() - started)
+        return data
+    
+    async def _hedged_post(self, payload: Dict[str, Any], headers: Dict[str, str], mode: str) -> Dict[str, Any]:
+        """
+        POST with an adaptive deadline; if it is still running at the observed
+        p95, send a duplicate and take whichever answers first
+        """
+        tracker = self._latency(mode)
+        deadline = self._deadline(tracker)
+        # Each request earns API_HEDGE_MAX_RATE of a hedge
+        self._hedge_tokens = min(HEDGE_BURST, self._hedge_tokens + API_HEDGE_MAX_RATE)
         
-        except Exception as e:
-            print(f"❌ API Exception: {str(e)}")
+        primary = asyncio.create_task(self._timed_post(payload, headers, tracker, deadline))
+        pending = {primary}
+        try:
+            hedge_after = tracker.percentile(0.95) if API_HEDGE_ENABLED else None
+            if hedge_after is not None and hedge_after < deadline and self._hedge_tokens >= 1:
+                done, _ = await asyncio.wait(pending, timeout=hedge_after)
+                if not done:
+                    self._hedge_tokens -= 1
+                    self.hedges_sent += 1
+                    pending.add(asyncio.create_task(self._timed_post(payload, headers, tracker, deadline)))
             
-            if retry_count < 2:
-                await asyncio.sleep((retry_count + 1) * 2)
-                return await self.get_answer(question, uid, mode, retry_count + 1)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedges_won += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _stream_post(self, payload: Dict[str, Any], headers: Dict[str, str], mode: str,
+                           on_progress: Callable[[str], None]) -> Dict[str, Any]:
+        """
+        POST asking for a streamed answer; on_progress gets the text so far
+        after every chunk. Events are SSE "data:" lines or NDJSON:
+            {"delta": "..."} ... then the final result {"success": ..., ...}
+        A backend that answers with plain JSON is handled like _post.
+        The "stream" latency tracker holds time to first content.
+        """
+        await self.init_session()
+        tracker = self._latency("stream")
+        deadline = self._deadline(tracker)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        
+        try:
+            response = await asyncio.wait_for(self.session.post(
+                WEBSITE_API_URL,
+                json=dict(payload, stream=True),
+                headers=dict(headers, Accept="text/event-stream, application/x-ndjson, application/json"),
+                compress="deflate" if API_COMPRESS_REQUESTS else None,
+                timeout=STREAM_TIMEOUT
+            ), deadline)
+        except asyncio.TimeoutError:
+            tracker.add(deadline)
+            raise
+        
+        async with response:
+            if response.status != 200:
+                raise BackendError(response.status)
+            if response.content_type == "application/json":
+                data = await asyncio.wait_for(response.json(), API_STREAM_IDLE_TIMEOUT)
+                tracker.add(loop.time() - started)
+                return data
             
-            # Fallback to mock
-            return await mock_api.get_mock_answer(question, uid, mode)
+            text = ""
+            first = True
+            while True:
+                timeout = max(0.0, started + deadline - loop.time()) if first else API_STREAM_IDLE_TIMEOUT
+                try:
+                    line = await asyncio.wait_for(response.content.readline(), timeout)
+                except asyncio.TimeoutError:
+                    if first:
+                        tracker.add(deadline)
+                    raise
+                if not line:
+                    raise ValueError("stream ended without a final result")
+                
+                line = line.strip()
+                if line.startswith(b"data:"):
+                    line = line[5:].strip()
+                if not line.startswith(b"{"):
+                    # Blank separators, SSE comments/"event:" lines, keep-alives
+                    continue
+                event = json.loads(line)
+                if first:
+                    first = False
+                    tracker.add(loop.time() - started)
+                
+                if "delta" not in event:
+                    if event.get("success") and text:
+                        event.setdefault("short_answer", text)
+                    return event
+                text += str(event["delta"])
+                try:
+                    on_progress(text)
+                except Exception as e:
+                    print(f"⚠️ Progress callback failed: {e}")
+    
+    async def _post(self, payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        """One POST to the website API; raises BackendError on a non-200 status"""
+        await self.init_session()
+        async with self.session.post(
+            WEBSITE_API_URL,
+            json=payload,
+            headers=headers,
+            compress="deflate" if API_COMPRESS_REQUESTS else None
+        ) as response:
+            if response.status != 200:
+                raise BackendError(response.status)
+            return await response.json()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Counters for /stats"""
+        pool = self.pool
+        breaker = self.breaker.stats()
+        limiter = self.limiter
+        batcher = self.batcher
+        stats = {
+            "backend calls": self.backend_calls,
+            "coalesced": self.coalesced,
+            "in flight": len(self._in_flight),
+            "retries": self.retry_policy.retries,
+            "circuit": (f"{breaker['state']} ({breaker['failures']} failures, "
+                        f"opened {breaker['times_opened']}x, {breaker['rejected']} fast fallbacks)"),
+            "hedges": f"{self.hedges_sent} sent, {self.hedges_won} won",
+            "batches": (f"{batcher.batches} sent, {batcher.items} questions, {batcher.item_failures} item / "
+                        f"{batcher.batch_failures} batch failures" if batcher.enabled else "off"),
+            "images": (f"{self.image_uploads} uploaded, {self.image_bytes_in // 1024} KB -> "
+                       f"{self.image_bytes_out // 1024} KB sent"),
+            "concurrency": f"{limiter.in_use}/{int(limiter.limit)} in use (limit {limiter.limit:.1f})",
+            "queue": (f"{limiter.queued} waiting now, max {limiter.max_queued}, avg wait "
+                      f"{limiter.wait_time / limiter.admitted * 1000 if limiter.admitted else 0:.0f} ms, "
+                      f"shed {'/'.join(str(n) for n in limiter.shed)} (admin/private/sol/passive)"),
+            "connections": f"{pool.created} opened, {pool.reused} reused (limit {API_POOL_LIMIT_PER_HOST}/host)",
+            "pool queue": (f"{pool.queued} waiting now, max {pool.max_queued}, {pool.queue_waits} waits"
+                           f" avg {pool.queue_wait_time / pool.queue_waits * 1000 if pool.queue_waits else 0:.0f} ms")
+        }
+        for mode, tracker in self.latency.items():
+            p50, p95, p99 = (tracker.percentile(q) for q in (0.5, 0.95, 0.99))
+            if p50 is None:
+                stats[f"latency {mode}"] = f"{len(tracker)} samples, warming up"
+            else:
+                stats[f"latency {mode}"] = (f"p50 {p50:.1f}s, p95 {p95:.1f}s, p99 {p99:.1f}s, "
+                                            f"deadline {self._deadline(tracker):.1f}s")
+        return stats
+    
+    async def get_cached_image_answer(self, file_unique_id: str) -> Optional[Dict[str, Any]]:
+        """Cached answer for a photo seen before (forwarded copies), checked before downloading it"""
+        if self.use_mock:
+            return None
+        return await image_cache.get(file_unique_id)
     
-    async def get_image_answer(self, file_path: str, uid: int) -> Dict[str, Any]:
+    async def get_image_answer(self, image: Photo, uid: int, priority: int = PRIORITY_PRIVATE,
+                               file_unique_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Get answer for image-based question
         
         Args:
-            file_path: Path to downloaded image
+            image: Photo bytes, or the path of a spooled photo (must exist
+                until this returns)
             uid: User ID
+            priority: PRIORITY_* constant; decides queue order under load
+            file_unique_id: Telegram's id of the photo; enables the photo
+                answer cache and merges concurrent requests for the same photo
         
         Returns:
             Dict with answer data
         """
         # Use mock for images if no API
         if self.use_mock:
-            return await mock_api.get_mock_image_answer(file_path, uid)
+            return await mock_api.get_mock_image_answer(image, uid)
         
-        # If real API exists, implement multipart upload here
-        # For now, fallback to mock
-        return await mock_api.get_mock_image_answer(file_path, uid)
+        if not file_unique_id:
+            return await self._fetch_image_answer(image, uid, Ticket(priority), None)
+        
+        # Single flight, as for text: copies of a viral photo arriving
+        # together share one hash lookup and upload
+        key = f"image:{file_unique_id}"
+        flight = self._in_flight.get(key)
+        if flight is None:
+            ticket = Ticket(priority)
+            # The shared request holds its own reference to the photo, so the
+            # first caller going away does not free or delete it mid-upload
+            spool.retain(image)
+            task = asyncio.create_task(self._fetch_retained_image_answer(image, uid, ticket, file_unique_id))
+            self._in_flight[key] = (task, ticket)
+            task.add_done_callback(lambda done: self._forget_in_flight(key, done))
+        else:
+            task, ticket = flight
+            ticket.raise_priority(priority)
+            self.coalesced += 1
+        
+        result = await asyncio.shield(task)
+        return dict(result)
+    
+    async def _fetch_retained_image_answer(self, image: Photo, uid: int, ticket: Ticket,
+                                           file_unique_id: str) -> Dict[str, Any]:
+        try:
+            return await self._fetch_image_answer(image, uid, ticket, file_unique_id)
+        finally:
+            await spool.release(image)
+    
+    async def _fetch_image_answer(self, image: Photo, uid: int, ticket: Ticket,
+                                  file_unique_id: Optional[str]) -> Dict[str, Any]:
+        upload, phash = await images.prepare_photo(image)
+        if file_unique_id:
+            cached = await image_cache.get_similar(file_unique_id, phash)
+            if cached is not None:
+                return cached
+        
+        self.backend_calls += 1
+        self.image_uploads += 1
+        self.image_bytes_in += photo_size(image)
+        self.image_bytes_out += photo_size(upload)
+        result = await self._call_backend(
+            lambda: self._post_image(upload, uid),
+            ticket,
+            lambda: self._fallback_image_answer(image, uid)
+        )
+        if file_unique_id:
+            image_cache.put(file_unique_id, phash, result)
+        return result
+    
+    async def _fallback_image_answer(self, image: Photo, uid: int) -> Dict[str, Any]:
+        result = await mock_api.get_mock_image_answer(image, uid)
+        result["fallback"] = True
+        return result
 
 # Global API client instance
 api_client = APIClient()
@@ -0,0 +1,172 @@
+"""
+Database backup module
+Online snapshots of bot_data.db via SQLite's backup API, gzip-compressed,
+rotated and optionally taken on a schedule. /dumpdb sends the latest one.
+"""
+
+import os
+import gzip
+import time
+import shutil
+import sqlite3
+import asyncio
+from datetime import datetime
+from typing import Optional, List
+import db
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+# Seconds between scheduled snapshots (0 = only on /dumpdb)
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "3600"))
+# Number of snapshots to keep
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "5"))
+# Pages copied per backup step and pause between steps, so writers get in
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "1024"))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))
+# A busy writer restarts a stepped backup; after this many restarts copy in one step
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+
+SNAPSHOT_PREFIX = "bot_data-"
+SNAPSHOT_SUFFIX = ".db.gz"
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_snapshot_lock = asyncio.Lock()
+_last_signature: Optional[tuple] = None
+_scheduler_task: Optional[asyncio.Task] = None
+
+class _TooManyRestarts(Exception):
+    pass
+
+def list_snapshots() -> List[str]:
+    """Snapshot files, oldest first"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(
+        os.path.join(BACKUP_DIR, name) for name in os.listdir(BACKUP_DIR)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+    )
+
+def latest_snapshot() -> Optional[str]:
+    """Newest snapshot, or None if there is none yet"""
+    snapshots = list_snapshots()
+    return snapshots[-1] if snapshots else None
+
+def _db_signature() -> tuple:
+    """Size/mtime of the database and its WAL; unchanged means nothing to back up"""
+    signature = []
+    for path in (db.DB_PATH, db.DB_PATH + "-wal"):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def _copy_database(target_path: str):
+    """Copy the live database into target_path (runs in a worker thread)"""
+    restarts = 0
+    last_remaining = None
+    
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        # remaining jumps back up when a writer forced the backup to restart
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+    
+    source = sqlite3.connect(db.DB_PATH)
+    try:
+        try:
+            target = sqlite3.connect(target_path)
+            try:
+                source.backup(target, pages=BACKUP_STEP_PAGES, progress=progress, sleep=BACKUP_STEP_PAUSE)
+            finally:
+                target.close()
+        except _TooManyRestarts:
+            # In WAL mode a single-step copy reads one consistent snapshot
+            # without blocking writers
+            print("⚠️ Backup kept restarting, copying in one step")
+            os.remove(target_path)
+            target = sqlite3.connect(target_path)
+            try:
+                source.backup(target, pages=-1)
+            finally:
+                target.close()
+    finally:
+        source.close()
+
+def _compress(source_path: str, target_path: str):
+    """gzip source_path into target_path in fixed-size chunks (worker thread)"""
+    with open(source_path, "rb") as src, gzip.open(target_path, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+def _rotate():
+    """Delete the oldest snapshots beyond BACKUP_KEEP"""
+    snapshots = list_snapshots()
+    for path in snapshots[:max(0, len(snapshots) - BACKUP_KEEP)]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"⚠️ Could not remove old backup {path}: {e}")
+
+async def create_snapshot(force: bool = False) -> Optional[str]:
+    """
+    Take a consistent, compressed snapshot of the database
+    Skipped (returns the latest snapshot) when nothing changed since the last one
+    """
+    global _last_signature
+    async with _snapshot_lock:
+        # Buffered writes belong in the snapshot
+        await db.flush_pending_writes()
+        
+        signature = _db_signature()
+        latest = latest_snapshot()
+        if not force and latest and signature == _last_signature:
+            return latest
+        
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        final_path = os.path.join(BACKUP_DIR, f"{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}")
+        raw_path = final_path + ".raw.tmp"
+        gz_path = final_path + ".tmp"
+        
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(_copy_database, raw_path)
+            await asyncio.to_thread(_compress, raw_path, gz_path)
+            os.replace(gz_path, final_path)
+        finally:
+            for path in (raw_path, gz_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        
+        _last_signature = signature
+        _rotate()
+        print(f"💾 Backup {final_path} ready in {time.monotonic() - started:.1f}s")
+        return final_path
+
+async def _scheduler_loop():
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        try:
+            await create_snapshot()
+        except Exception as e:
+            print(f"❌ Scheduled backup failed: {e}")
+
+def start_scheduler():
+    """Start periodic snapshots (no-op when BACKUP_INTERVAL is 0)"""
+    global _scheduler_task
+    if BACKUP_INTERVAL > 0 and _scheduler_task is None:
+        _scheduler_task = asyncio.create_task(_scheduler_loop())
+
+async def stop_scheduler():
+    """Stop periodic snapshots"""
+    global _scheduler_task
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
+        try:
+            await _scheduler_task
+        except asyncio.CancelledError:
+            pass
+        _scheduler_task = None
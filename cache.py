@@ -0,0 +1,81 @@
+"""
+In-process caches for the bot
+Bounded LRU cache with per-entry TTL and hit/miss counters
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# name -> cache (anything with a stats() method), for /stats
+_registry: Dict[str, Any] = {}
+
+def register(name: str, cache: Any):
+    """Show a cache's stats() in /stats"""
+    _registry[name] = cache
+
+def get_all_stats() -> Dict[str, Dict[str, Any]]:
+    """Counters of every named cache"""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+class TTLCache:
+    """LRU cache whose entries also expire after a TTL (seconds)"""
+    
+    def __init__(self, maxsize: int, ttl: float, name: Optional[str] = None):
+        if name:
+            register(name, self)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a live entry (and mark it recently used) or `default`"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value; `ttl` overrides the cache default for this entry"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry and return its value"""
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else default
+    
+    def clear(self):
+        self._data.clear()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Counters for /stats"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0
+        }
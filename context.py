@@ -0,0 +1,50 @@
+"""
+Per-update request context for private chat handlers
+Loads everything a handler needs about the user once, up front
+"""
+
+import os
+import functools
+from typing import Optional, Dict
+from pyrogram.client import Client
+from pyrogram.types import Message
+import db
+
+OWNER_ID = int(os.getenv("OWNER_ID", "0"))
+
+class UserContext:
+    """User state for one update (language, admin flag, pending force join prompt)"""
+    
+    def __init__(self, uid: int, language: str, is_admin: bool, pending: Optional[Dict]):
+        self.uid = uid
+        self.language = language
+        self.is_owner = uid == OWNER_ID
+        self.is_admin = self.is_owner or is_admin
+        self.pending = pending
+
+async def load_context(message: Message) -> UserContext:
+    """Upsert the sender and load their state (at most one DB read)"""
+    user = message.from_user
+    state = await db.load_user_context(
+        uid=user.id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name
+    )
+    return UserContext(
+        uid=user.id,
+        language=state["language"],
+        is_admin=await db.is_bot_admin(user.id),
+        pending=state["pending"]
+    )
+
+def with_user_context(handler):
+    """
+    Handler decorator: builds the UserContext and passes it as a third argument
+    handler(client, message, ctx)
+    """
+    @functools.wraps(handler)
+    async def wrapper(client: Client, message: Message):
+        ctx = await load_context(message)
+        return await handler(client, message, ctx)
+    return wrapper
@@ -2,214 +2,1018 @@
 Database module for Telegram Bot
 SQLite database with aiosqlite for async operations
 Tables: users, groups, admins, usage_logs, force_join, pending_prompt_messages
+Stats rollups: counters, usage_hourly, usage_daily, daily_users, daily_active
 """
 
+import os
+import time
 import aiosqlite
 import asyncio
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+from cache import TTLCache
 
 DB_PATH = "bot_data.db"
 
+# Connection pool settings
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Write-behind settings: flush when this many writes are pending or every N seconds
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "500"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "2.0"))
+
+# User profile cache: LRU size, entry TTL, and how stale last_seen may get before re-writing it
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "3600"))
+LAST_SEEN_REFRESH = float(os.getenv("LAST_SEEN_REFRESH", "300"))
+
+# Force join list is re-read at least this often (seconds) even without local changes
+FORCE_JOIN_CACHE_TTL = float(os.getenv("FORCE_JOIN_CACHE_TTL", "300"))
+
+# Seconds between checks for admin changes made by other processes (0 = never)
+ADMIN_SYNC_INTERVAL = float(os.getenv("ADMIN_SYNC_INTERVAL", "30"))
+
+# usage_logs retention: rows older than N days move to monthly archive files (0 = keep forever)
+USAGE_LOG_RETENTION_DAYS = int(os.getenv("USAGE_LOG_RETENTION_DAYS", "90"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "2000"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.2"))
+
+# Persistent answer cache (answer_cache.py keeps the in-memory tier)
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ROWS = int(os.getenv("ANSWER_CACHE_MAX_ROWS", "100000"))
+
+# Persistent photo answer cache (image_cache.py keeps the memory tier and hash index)
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", str(30 * 24 * 3600)))
+IMAGE_CACHE_MAX_ROWS = int(os.getenv("IMAGE_CACHE_MAX_ROWS", "20000"))
+
+# ==================== CONNECTION POOL ====================
+# One writer connection (serialized by a lock) plus a small set of reader
+# connections, all in WAL mode so readers never block the writer.
+
+_writer: Optional[aiosqlite.Connection] = None
+_write_lock: Optional[asyncio.Lock] = None
+_readers: Optional[asyncio.Queue] = None
+_reader_conns: List[aiosqlite.Connection] = []
+_pool_lock = asyncio.Lock()
+
+async def _open_connection() -> aiosqlite.Connection:
+    """Open a connection with the tuned pragmas applied"""
+    conn = await aiosqlite.connect(DB_PATH)
+    conn.row_factory = aiosqlite.Row
+    # Only takes effect on a brand new file (older ones are converted once by
+    # _enable_incremental_vacuum); lets retention give space back
+    await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    await conn.execute("PRAGMA journal_mode = WAL")
+    await conn.execute("PRAGMA synchronous = NORMAL")
+    await conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    await conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    await conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    await conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+async def open_pool():
+    """Open the writer and reader connections (idempotent)"""
+    global _writer, _write_lock, _readers, _reader_conns
+    async with _pool_lock:
+        if _writer is not None:
+            return
+        
+        # Writer first so WAL mode is set before readers attach
+        writer = await _open_connection()
+        readers: asyncio.Queue = asyncio.Queue()
+        conns = []
+        for _ in range(max(1, DB_READERS)):
+            conn = await _open_connection()
+            conns.append(conn)
+            readers.put_nowait(conn)
+        
+        _writer = writer
+        _write_lock = asyncio.Lock()
+        _readers = readers
+        _reader_conns = conns
+
+async def close_db():
+    """
+    Close all pooled connections
+    बंद करते समय सभी connections बंद करें
+    """
+    global _writer, _write_lock, _readers, _reader_conns, _admin_sync_task
+    
+    # Stop background jobs and drain buffered writes while the writer is still open
+    if _admin_sync_task is not None:
+        _admin_sync_task.cancel()
+        try:
+            await _admin_sync_task
+        except asyncio.CancelledError:
+            pass
+        _admin_sync_task = None
+    await _stop_retention()
+    await _write_behind.stop()
+    
+    async with _pool_lock:
+        if _writer is None:
+            return
+        
+        # Wait for any in-progress write to finish
+        async with _write_lock:
+            try:
+                await _writer.execute("PRAGMA optimize")
+            except Exception as e:
+                print(f"⚠️ PRAGMA optimize failed: {e}")
+            await _writer.close()
+        
+        for conn in _reader_conns:
+            await conn.close()
+        
+        _writer = None
+        _write_lock = None
+        _readers = None
+        _reader_conns = []
+        print("✅ Database connections closed")
+
+@asynccontextmanager
+async def _read() -> AsyncIterator[aiosqlite.Connection]:
+    """Borrow a reader connection from the pool"""
+    if _writer is None:
+        await open_pool()
+    conn = await _readers.get()
+    try:
+        yield conn
+    finally:
+        _readers.put_nowait(conn)
+
+@asynccontextmanager
+async def _write() -> AsyncIterator[aiosqlite.Connection]:
+    """
+    Hold the writer connection for one transaction
+    Commits on success, rolls back on error
+    """
+    if _writer is None:
+        await open_pool()
+    async with _write_lock:
+        try:
+            yield _writer
+        except BaseException:
+            await _writer.rollback()
+            raise
+        else:
+            await _writer.commit()
+
+# ==================== WRITE-BEHIND QUEUE ====================
+# Hot-path bookkeeping (user upserts, question counters, usage logs, cached
+# text and photo answers) is buffered in memory, merged per key and flushed in one transaction.
+
+INCREMENT_QUESTIONS_SQL = "UPDATE users SET total_questions = total_questions + ? WHERE uid = ?"
+ANSWER_HIT_SQL = "UPDATE answer_cache SET last_hit = ? WHERE key = ?"
+IMAGE_HIT_SQL = "UPDATE image_cache SET last_hit = ? WHERE file_unique_id = ?"
+
+class _WriteBehind:
+    """Buffer for usage logging and user bookkeeping writes"""
+    
+    def __init__(self):
+        # uid -> (username, first_name, last_name, last_seen, joined_at)
+        self.users: Dict[int, tuple] = {}
+        # uid -> pending increment
+        self.question_counts: Dict[int, int] = {}
+        # (uid, gid, cmd, qtext, ts)
+        self.logs: List[tuple] = []
+        # answer key -> (mode, question, payload, created_at)
+        self.answers: Dict[str, tuple] = {}
+        # answer key -> last hit time
+        self.answer_hits: Dict[str, float] = {}
+        # file_unique_id -> (phash, payload, created_at)
+        self.images: Dict[str, tuple] = {}
+        # file_unique_id -> last hit time
+        self.image_hits: Dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+    
+    def pending(self) -> int:
+        """Number of buffered writes"""
+        return (len(self.users) + len(self.question_counts) + len(self.logs)
+                + len(self.answers) + len(self.answer_hits) + len(self.images) + len(self.image_hits))
+    
+    def _added(self):
+        if self._wakeup and self.pending() >= WRITE_BEHIND_MAX_PENDING:
+            self._wakeup.set()
+    
+    def add_user(self, uid: int, username: Optional[str], first_name: Optional[str], last_name: Optional[str]):
+        now = datetime.now()
+        previous = self.users.get(uid)
+        joined_at = previous[4] if previous else now
+        self.users[uid] = (username, first_name, last_name, now, joined_at)
+        self._added()
+    
+    def add_question(self, uid: int):
+        self.question_counts[uid] = self.question_counts.get(uid, 0) + 1
+        self._added()
+    
+    def add_log(self, uid: int, gid: Optional[int], cmd: Optional[str], qtext: Optional[str]):
+        self.logs.append((uid, gid, cmd, qtext, datetime.now()))
+        self._added()
+    
+    def add_answer(self, key: str, mode: str, question: str, payload: bytes):
+        self.answers[key] = (mode, question, payload, time.time())
+        self._added()
+    
+    def add_answer_hit(self, key: str):
+        self.answer_hits[key] = time.time()
+        self._added()
+    
+    def add_image(self, file_unique_id: str, phash: Optional[bytes], payload: bytes):
+        self.images[file_unique_id] = (phash, payload, time.time())
+        self._added()
+    
+    def add_image_hit(self, file_unique_id: str):
+        self.image_hits[file_unique_id] = time.time()
+        self._added()
+    
+    def _requeue(self, users: Dict[int, tuple], counts: Dict[int, int], logs: List[tuple],
+                 answers: Dict[str, tuple], answer_hits: Dict[str, float],
+                 images: Dict[str, tuple], image_hits: Dict[str, float]):
+        """Put a failed batch back without losing newer buffered writes"""
+        for uid, row in users.items():
+            newer = self.users.get(uid)
+            self.users[uid] = newer[:4] + (row[4],) if newer else row
+        for uid, count in counts.items():
+            self.question_counts[uid] = self.question_counts.get(uid, 0) + count
+        self.logs[:0] = logs
+        for key, row in answers.items():
+            self.answers.setdefault(key, row)
+        for key, hit in answer_hits.items():
+            self.answer_hits.setdefault(key, hit)
+        for file_unique_id, row in images.items():
+            self.images.setdefault(file_unique_id, row)
+        for file_unique_id, hit in image_hits.items():
+            self.image_hits.setdefault(file_unique_id, hit)
+    
+    async def flush(self):
+        """Write everything buffered so far in a single transaction"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        
+        async with self._flush_lock:
+            if not self.pending():
+                return
+            
+            users, self.users = self.users, {}
+            counts, self.question_counts = self.question_counts, {}
+            logs, self.logs = self.logs, []
+            answers, self.answers = self.answers, {}
+            answer_hits, self.answer_hits = self.answer_hits, {}
+            images, self.images = self.images, {}
+            image_hits, self.image_hits = self.image_hits, {}
+            
+            try:
+                async with _write() as db:
+                    # Users first so counter updates find their rows
+                    if users:
+                        await db.executemany("""
+                            INSERT INTO users (uid, username, first_name, last_name, last_seen, joined_at)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(uid) DO UPDATE SET
+                                username = excluded.username,
+                                first_name = excluded.first_name,
+                                last_name = excluded.last_name,
+                                last_seen = excluded.last_seen
+                        """, [(uid,) + row for uid, row in users.items()])
+                    
+                    if counts:
+                        await db.executemany(
+                            INCREMENT_QUESTIONS_SQL, [(count, uid) for uid, count in counts.items()]
+                        )
+                    
+                    if logs:
+                        await db.executemany("""
+                            INSERT INTO usage_logs (uid, gid, cmd, qtext, ts)
+                            VALUES (?, ?, ?, ?, ?)
+                        """, logs)
+                        await _apply_rollups(db, logs)
+                    
+                    if answers:
+                        await db.executemany("""
+                            INSERT OR REPLACE INTO answer_cache (key, mode, question, payload, created_at, last_hit)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        """, [(key, mode, question, payload, created, created)
+                              for key, (mode, question, payload, created) in answers.items()])
+                    
+                    if answer_hits:
+                        await db.executemany(ANSWER_HIT_SQL, [(hit, key) for key, hit in answer_hits.items()])
+                    
+                    if images:
+                        await db.executemany("""
+                            INSERT OR REPLACE INTO image_cache (file_unique_id, phash, payload, created_at, last_hit)
+                            VALUES (?, ?, ?, ?, ?)
+                        """, [(file_unique_id, phash, payload, created, created)
+                              for file_unique_id, (phash, payload, created) in images.items()])
+                    
+                    if image_hits:
+                        await db.executemany(
+                            IMAGE_HIT_SQL, [(hit, file_unique_id) for file_unique_id, hit in image_hits.items()]
+                        )
+            except BaseException:
+                # Cancellation rolls the transaction back too, so requeue on it as well
+                self._requeue(users, counts, logs, answers, answer_hits, images, image_hits)
+                raise
+            
+            if answers:
+                await _note_answer_rows(len(answers))
+            if images:
+                await _note_image_rows(len(images))
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=WRITE_BEHIND_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Write-behind flush failed: {e}")
+    
+    def start(self):
+        """Start the background flusher"""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background flusher and write out anything left"""
+        if self._task is not None:
+            # Let a flush in progress finish instead of cancelling it mid-transaction
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"❌ Final write-behind flush failed: {e}")
+
+_write_behind = _WriteBehind()
+
+async def flush_pending_writes():
+    """Force buffered writes to disk (e.g. before reading exact stats)"""
+    await _write_behind.flush()
+
 async def init_db():
     """
     Initialize database and create all required tables
     डेटाबेस शुरू करें और सभी टेबल बनाएं
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Users table - store all bot users
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                uid INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                last_seen TIMESTAMP,
-                total_questions INTEGER DEFAULT 0,
-                joined_at TIMESTAMP,
-                language TEXT DEFAULT 'hindi'
-            )
-        """)
-        
-        # Groups table - store all groups where bot is added
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS groups (
-                gid INTEGER PRIMARY KEY,
-                title TEXT,
-                username TEXT,
-                added_at TIMESTAMP,
-                chat_on BOOLEAN DEFAULT 1
-            )
-        """)
-        
-        # Admins table - bot admins (not group admins)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS admins (
-                uid INTEGER PRIMARY KEY,
-                promoted_by INTEGER,
-                promoted_at TIMESTAMP
-            )
-        """)
+    global _admin_sync_task
+    await open_pool()
+    
+    await migrate()
+    await _enable_incremental_vacuum()
+    
+    for problem in await check_query_plans():
+        print(f"⚠️ Query plan: {problem}")
+    
+    await _load_groups()
+    await refresh_admins(force=True)
+    await prune_answer_cache()
+    await prune_image_cache()
+    
+    _write_behind.start()
+    _start_retention()
+    if ADMIN_SYNC_INTERVAL > 0 and _admin_sync_task is None:
+        _admin_sync_task = asyncio.create_task(_admin_sync_loop())
+    print("✅ Database initialized successfully")
+
+async def _enable_incremental_vacuum():
+    """
+    Switch a database created before auto_vacuum was set to incremental
+    auto_vacuum only changes on an existing file through a full VACUUM,
+    which cannot run inside the migration transaction; this is a one-time
+    rebuild of the file, after which retention's incremental_vacuum can
+    shrink it.
+    """
+    async with _write_lock:
+        async with _writer.execute("PRAGMA auto_vacuum") as cursor:
+            mode = (await cursor.fetchone())[0]
+        if mode == 2:
+            return
         
-        # Usage logs - track all commands and queries
+        print("🔄 Converting database to incremental auto_vacuum (one-time VACUUM)...")
+        started = time.monotonic()
+        await _writer.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await _writer.execute("VACUUM")
+        print(f"✅ Database converted in {time.monotonic() - started:.1f}s")
+
+# ==================== SCHEMA MIGRATIONS ====================
+# Ordered, numbered schema steps. Pending steps run together in one
+# BEGIN IMMEDIATE transaction and are recorded in schema_version; an
+# up-to-date database only costs one read at startup.
+
+async def _migration_base_tables(db: aiosqlite.Connection):
+    """Original six tables (plus the language column for old databases)"""
+    # Users table - store all bot users
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            uid INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            last_seen TIMESTAMP,
+            total_questions INTEGER DEFAULT 0,
+            joined_at TIMESTAMP,
+            language TEXT DEFAULT 'hindi'
+        )
+    """)
+    
+    # Groups table - store all groups where bot is added
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS groups (
+            gid INTEGER PRIMARY KEY,
+            title TEXT,
+            username TEXT,
+            added_at TIMESTAMP,
+            chat_on BOOLEAN DEFAULT 1
+        )
+    """)
+    
+    # Admins table - bot admins (not group admins)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS admins (
+            uid INTEGER PRIMARY KEY,
+            promoted_by INTEGER,
+            promoted_at TIMESTAMP
+        )
+    """)
+    
+    # Usage logs - track all commands and queries
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS usage_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uid INTEGER,
+            gid INTEGER,
+            cmd TEXT,
+            qtext TEXT,
+            ts TIMESTAMP
+        )
+    """)
+    
+    # Force join - channels/groups users must join
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS force_join (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            chat_type TEXT,
+            chat_title TEXT,
+            chat_username TEXT,
+            added_by INTEGER,
+            added_at TIMESTAMP
+        )
+    """)
+    
+    # Pending prompt messages - store message IDs for force join prompts
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS pending_prompt_messages (
+            uid INTEGER PRIMARY KEY,
+            message_id INTEGER,
+            chat_id INTEGER
+        )
+    """)
+    
+    # Databases from before the language setting lack this column
+    async with db.execute("PRAGMA table_info(users)") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if "language" not in columns:
+        await db.execute("ALTER TABLE users ADD COLUMN language TEXT DEFAULT 'hindi'")
+        print("🔄 Added language column to existing users")
+
+async def _migration_indexes(db: aiosqlite.Connection):
+    await _create_indexes(db)
+
+async def _migration_stats_rollups(db: aiosqlite.Connection):
+    # Only backfill when the rollups are new; existing ones may already
+    # include rows that were archived since
+    if await _create_rollup_tables(db):
+        print("🔄 Backfilling stats rollups from usage logs...")
+        await _rebuild_rollups(db)
+
+async def _migration_answer_cache(db: aiosqlite.Connection):
+    await _create_answer_cache_table(db)
+
+async def _migration_image_cache(db: aiosqlite.Connection):
+    await _create_image_cache_table(db)
+
+# (version, description, step) - append only, never renumber
+MIGRATIONS = [
+    (1, "base tables", _migration_base_tables),
+    (2, "usage_logs and force_join indexes", _migration_indexes),
+    (3, "stats rollup tables", _migration_stats_rollups),
+    (4, "answer cache", _migration_answer_cache),
+    (5, "image answer cache", _migration_image_cache),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+async def _schema_version(db: aiosqlite.Connection) -> int:
+    """Current schema version (0 for a new or pre-migration database)"""
+    async with db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ) as cursor:
+        if await cursor.fetchone() is None:
+            return 0
+    async with db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0]
+
+async def migrate() -> int:
+    """
+    Bring the schema up to SCHEMA_VERSION
+    Returns the number of migrations applied (0 on the fast path)
+    """
+    async with _read() as db:
+        if await _schema_version(db) >= SCHEMA_VERSION:
+            return 0
+    
+    async with _write() as db:
+        # Take the write lock up front so DDL is part of the transaction and
+        # a second process starting at the same time waits, then re-checks
+        await db.execute("BEGIN IMMEDIATE")
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS usage_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uid INTEGER,
-                gid INTEGER,
-                cmd TEXT,
-                qtext TEXT,
-                ts TIMESTAMP
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP
             )
         """)
+        current = await _schema_version(db)
         
-        # Force join - channels/groups users must join
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS force_join (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER,
-                chat_type TEXT,
-                chat_title TEXT,
-                chat_username TEXT,
-                added_by INTEGER,
-                added_at TIMESTAMP
-            )
+        applied = 0
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            started = time.monotonic()
+            await step(db)
+            await db.execute("""
+                INSERT INTO schema_version (version, description, applied_at)
+                VALUES (?, ?, ?)
+            """, (version, description, datetime.now()))
+            applied += 1
+            print(f"🔄 Migration {version} ({description}) applied in {time.monotonic() - started:.1f}s")
+    
+    return applied
+
+# ==================== INDEXES ====================
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_usage_logs_ts_uid ON usage_logs(ts, uid)",
+    "CREATE INDEX IF NOT EXISTS idx_usage_logs_gid_ts ON usage_logs(gid, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_usage_logs_cmd_ts ON usage_logs(cmd, ts)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_force_join_chat_id ON force_join(chat_id)",
+]
+
+async def _create_indexes(db: aiosqlite.Connection):
+    """Create the index set, cleaning up data that would violate it"""
+    # Older databases could hold the same force join chat more than once
+    cursor = await db.execute("""
+        DELETE FROM force_join WHERE id NOT IN (
+            SELECT MIN(id) FROM force_join GROUP BY chat_id
+        )
+    """)
+    if cursor.rowcount > 0:
+        print(f"🔄 Removed {cursor.rowcount} duplicate force join rows")
+    
+    for statement in INDEXES:
+        await db.execute(statement)
+
+# ==================== STATS ROLLUPS ====================
+# /stats reads pre-aggregated counters instead of counting base tables.
+# usage_hourly/usage_daily/daily_users are fed by the write-behind flush;
+# counters and daily_active are kept in step by triggers.
+
+HOUR_FORMAT = "%Y-%m-%d %H:00"
+DAY_FORMAT = "%Y-%m-%d"
+
+async def _create_rollup_tables(db: aiosqlite.Connection) -> bool:
+    """Create rollup tables and triggers. Returns True if they were new."""
+    async with db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'counters'"
+    ) as cursor:
+        existed = await cursor.fetchone() is not None
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    
+    # gid = 0 for private chats, cmd = '' when not set
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS usage_hourly (
+            hour TEXT,
+            cmd TEXT,
+            gid INTEGER,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, cmd, gid)
+        ) WITHOUT ROWID
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            day TEXT,
+            cmd TEXT,
+            gid INTEGER,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, cmd, gid)
+        ) WITHOUT ROWID
+    """)
+    
+    # Distinct users per day
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_users (
+            day TEXT,
+            uid INTEGER,
+            PRIMARY KEY (day, uid)
+        ) WITHOUT ROWID
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_active (
+            day TEXT PRIMARY KEY,
+            users INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    
+    for table, counter in (("users", "total_users"), ("groups", "total_groups")):
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = '{counter}';
+            END
         """)
-        
-        # Pending prompt messages - store message IDs for force join prompts
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS pending_prompt_messages (
-                uid INTEGER PRIMARY KEY,
-                message_id INTEGER,
-                chat_id INTEGER
-            )
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE counters SET value = value - 1 WHERE name = '{counter}';
+            END
         """)
+    
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_users_insert AFTER INSERT ON daily_users
+        BEGIN
+            INSERT INTO daily_active (day, users) VALUES (NEW.day, 1)
+            ON CONFLICT(day) DO UPDATE SET users = users + 1;
+        END
+    """)
+    
+    return not existed
+
+async def _rebuild_rollups(db: aiosqlite.Connection):
+    """Recompute every rollup table from the base tables"""
+    for table in ("usage_hourly", "usage_daily", "daily_users", "daily_active"):
+        await db.execute(f"DELETE FROM {table}")
+    # Other counters (e.g. admins_version) are not derived from the logs
+    await db.execute("""
+        DELETE FROM counters WHERE name IN ('total_users', 'total_groups', 'total_queries')
+    """)
+    
+    await db.execute("""
+        INSERT INTO counters (name, value)
+        SELECT 'total_users', COUNT(*) FROM users
+        UNION ALL SELECT 'total_groups', COUNT(*) FROM groups
+        UNION ALL SELECT 'total_queries', COUNT(*) FROM usage_logs
+    """)
+    
+    await db.execute(f"""
+        INSERT INTO usage_hourly (hour, cmd, gid, count)
+        SELECT strftime('{HOUR_FORMAT}', ts), COALESCE(cmd, ''), COALESCE(gid, 0), COUNT(*)
+        FROM usage_logs GROUP BY 1, 2, 3
+    """)
+    
+    await db.execute(f"""
+        INSERT INTO usage_daily (day, cmd, gid, count)
+        SELECT strftime('{DAY_FORMAT}', ts), COALESCE(cmd, ''), COALESCE(gid, 0), COUNT(*)
+        FROM usage_logs GROUP BY 1, 2, 3
+    """)
+    
+    # daily_active is filled by the daily_users trigger
+    await db.execute(f"""
+        INSERT OR IGNORE INTO daily_users (day, uid)
+        SELECT DISTINCT strftime('{DAY_FORMAT}', ts), uid FROM usage_logs
+    """)
+
+async def rebuild_stats_rollups():
+    """
+    Rebuild stats rollups from existing usage logs (admin /rebuildstats)
+    """
+    await _write_behind.flush()
+    async with _rollup_rebuild_lock:
+        async with _write() as db:
+            await _rebuild_rollups(db)
         
-        await db.commit()
+        # Archived months still count towards the totals
+        for path in archive_files():
+            await _merge_archived_rollups(path)
+    print("✅ Stats rollups rebuilt")
+
+async def _apply_rollups(db: aiosqlite.Connection, logs: List[tuple]):
+    """Fold a batch of (uid, gid, cmd, qtext, ts) log rows into the rollups"""
+    hourly: Dict[tuple, int] = {}
+    daily: Dict[tuple, int] = {}
+    day_users = set()
+    
+    for uid, gid, cmd, _, ts in logs:
+        day = ts.strftime(DAY_FORMAT)
+        hour_key = (ts.strftime(HOUR_FORMAT), cmd or "", gid or 0)
+        day_key = (day, cmd or "", gid or 0)
+        hourly[hour_key] = hourly.get(hour_key, 0) + 1
+        daily[day_key] = daily.get(day_key, 0) + 1
+        day_users.add((day, uid))
+    
+    await db.executemany("""
+        INSERT INTO usage_hourly (hour, cmd, gid, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(hour, cmd, gid) DO UPDATE SET count = count + excluded.count
+    """, [key + (count,) for key, count in hourly.items()])
+    
+    await db.executemany("""
+        INSERT INTO usage_daily (day, cmd, gid, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(day, cmd, gid) DO UPDATE SET count = count + excluded.count
+    """, [key + (count,) for key, count in daily.items()])
+    
+    await db.executemany(
+        "INSERT OR IGNORE INTO daily_users (day, uid) VALUES (?, ?)",
+        list(day_users)
+    )
+    
+    await db.execute("""
+        INSERT INTO counters (name, value) VALUES ('total_queries', ?)
+        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+    """, (len(logs),))
+
+# ==================== PAGINATED ITERATORS ====================
+# Keyset pagination: each page borrows a reader only for one query, so a
+# slow consumer (e.g. a broadcast) never pins a pooled connection.
+
+PAGE_SIZE = int(os.getenv("DB_PAGE_SIZE", "1000"))
+
+TABLE_COLUMNS = {
+    "users": {"uid", "username", "first_name", "last_name", "last_seen", "total_questions", "joined_at", "language"},
+    "groups": {"gid", "title", "username", "added_at", "chat_on"},
+}
+
+# Keyset page of a table (filled in with the columns, table and primary key)
+ITER_TABLE_SQL = "SELECT {select} FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?"
+
+async def _iter_table(table: str, key: str, columns: tuple, batch_size: int) -> AsyncIterator[Dict]:
+    """Yield rows of `table` as dicts, paging by primary key"""
+    unknown = set(columns) - TABLE_COLUMNS[table]
+    if unknown:
+        raise ValueError(f"Unknown {table} columns: {', '.join(sorted(unknown))}")
+    
+    select = ", ".join([key] + [c for c in columns if c != key])
+    sql = ITER_TABLE_SQL.format(select=select, table=table, key=key)
+    last_key = -(2 ** 63)
+    
+    while True:
+        async with _read() as db:
+            async with db.execute(sql, (last_key, batch_size)) as cursor:
+                rows = await cursor.fetchall()
         
-        # Migration: Add language column if it doesn't exist
-        try:
-            await db.execute("SELECT language FROM users LIMIT 1")
-        except:
-            await db.execute("ALTER TABLE users ADD COLUMN language TEXT DEFAULT 'hindi'")
-            await db.commit()
-            print("🔄 Added language column to existing users")
+        for row in rows:
+            yield dict(row)
         
-        print("✅ Database initialized successfully")
+        if len(rows) < batch_size:
+            return
+        last_key = rows[-1][0]
+
+async def get_counter(name: str) -> int:
+    """Read a maintained counter (total_users, total_groups, total_queries)"""
+    async with _read() as db:
+        async with db.execute("SELECT value FROM counters WHERE name = ?", (name,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else 0
 
 # ==================== USER OPERATIONS ====================
 
-async def add_or_update_user(uid: int, username: Optional[str] = None, first_name: Optional[str] = None, last_name: Optional[str] = None):
-    """Add new user or update existing user's last seen"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            INSERT INTO users (uid, username, first_name, last_name, last_seen, joined_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(uid) DO UPDATE SET
-                username = ?,
-                first_name = ?,
-                last_name = ?,
-                last_seen = ?
-        """, (uid, username, first_name, last_name, datetime.now(), datetime.now(),
-              username, first_name, last_name, datetime.now()))
-        await db.commit()
+# uid -> {"username", "first_name", "last_name", "language", "seen_at", ["pending"]}
+# language is None until it has been read; seen_at is a time.monotonic() stamp;
+# "pending" (force join prompt dict or None) is only present once known
+_user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL, name="user_profiles")
+
+async def add_or_update_user(uid: int, username: Optional[str] = None, first_name: Optional[str] = None, last_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Add new user or update existing user's last seen (buffered)
+    Skipped when the cached profile is unchanged and last_seen is fresh.
+    Returns the profile, which the cache may not keep (USER_CACHE_SIZE=0)
+    """
+    now = time.monotonic()
+    profile = _user_cache.get(uid)
+    
+    if (profile is not None
+            and profile["seen_at"] is not None
+            and now - profile["seen_at"] < LAST_SEEN_REFRESH
+            and (profile["username"], profile["first_name"], profile["last_name"]) == (username, first_name, last_name)):
+        return profile
+    
+    _write_behind.add_user(uid, username, first_name, last_name)
+    if profile is None:
+        profile = {"language": None}
+    profile.update(username=username, first_name=first_name, last_name=last_name, seen_at=now)
+    _user_cache.set(uid, profile)
+    return profile
+
+# Language and pending force join prompt in one round-trip
+USER_CONTEXT_SQL = """
+    SELECT
+        (SELECT language FROM users WHERE uid = ?1),
+        (SELECT message_id FROM pending_prompt_messages WHERE uid = ?1),
+        (SELECT chat_id FROM pending_prompt_messages WHERE uid = ?1)
+"""
+
+async def load_user_context(uid: int, username: Optional[str] = None, first_name: Optional[str] = None, last_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Per-update user state: upsert the user and return language and pending prompt
+    The upsert goes through the write-behind queue; language and pending
+    prompt come from the profile cache or, on a miss, one combined read.
+    """
+    profile = await add_or_update_user(uid, username, first_name, last_name)
+    
+    if profile["language"] is None or "pending" not in profile:
+        async with _read() as db:
+            async with db.execute(USER_CONTEXT_SQL, (uid,)) as cursor:
+                row = await cursor.fetchone()
+        
+        profile["language"] = row[0] or 'hindi'
+        profile["pending"] = {"uid": uid, "message_id": row[1], "chat_id": row[2]} if row[1] is not None else None
+    
+    return {
+        "language": profile["language"],
+        "pending": profile["pending"]
+    }
 
 async def increment_user_questions(uid: int):
-    """Increment user's total questions count"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            UPDATE users SET total_questions = total_questions + 1
-            WHERE uid = ?
-        """, (uid,))
-        await db.commit()
+    """Increment user's total questions count (buffered)"""
+    _write_behind.add_question(uid)
 
 async def set_user_language(uid: int, language: str):
-    """Set user's preferred language"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Set user's preferred language (write-through to the profile cache)"""
+    # The user's row may still be sitting in the write-behind buffer
+    await _write_behind.flush()
+    async with _write() as db:
         await db.execute("""
             UPDATE users SET language = ?
             WHERE uid = ?
         """, (language, uid))
-        await db.commit()
+    
+    profile = _user_cache.get(uid)
+    if profile is not None:
+        profile["language"] = language
 
-async def get_user_language(uid: int) -> str:
-    """Get user's preferred language, default to hindi"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT language FROM users WHERE uid = ?", (uid,)) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row and row[0] else 'hindi'
-
-async def get_all_users() -> List[Dict]:
-    """Get all users for broadcasting"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM users") as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+async def iter_users(columns: tuple = ("uid",), batch_size: int = PAGE_SIZE) -> AsyncIterator[Dict]:
+    """Stream users in uid order, fetching only the requested columns"""
+    async for row in _iter_table("users", "uid", columns, batch_size):
+        yield row
 
 # ==================== GROUP OPERATIONS ====================
 
+# gid -> {"title", "username", "chat_on"}; loaded in init_db and kept in
+# step by add_group/set_chat_status so status checks need no I/O
+_groups: Dict[int, Dict[str, Any]] = {}
+
+async def _load_groups():
+    """Load the groups table into memory"""
+    groups = {}
+    async for group in iter_groups(("gid", "title", "username", "chat_on")):
+        groups[group["gid"]] = {
+            "title": group["title"],
+            "username": group["username"],
+            "chat_on": bool(group["chat_on"])
+        }
+    _groups.clear()
+    _groups.update(groups)
+
 async def add_group(gid: int, title: str, username: Optional[str] = None):
     """Add new group to database"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("""
             INSERT OR IGNORE INTO groups (gid, title, username, added_at, chat_on)
             VALUES (?, ?, ?, ?, 1)
         """, (gid, title, username, datetime.now()))
-        await db.commit()
+    
+    if gid not in _groups:
+        _groups[gid] = {"title": title, "username": username, "chat_on": True}
+
+async def ensure_group(gid: int, title: str, username: Optional[str] = None):
+    """Register a group seen for the first time since startup (no I/O if known)"""
+    if gid not in _groups:
+        await add_group(gid, title, username)
 
 async def set_chat_status(gid: int, status: bool):
     """Set chat on/off status for a group"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("""
             UPDATE groups SET chat_on = ?
             WHERE gid = ?
         """, (1 if status else 0, gid))
-        await db.commit()
+    
+    if gid in _groups:
+        _groups[gid]["chat_on"] = status
 
 async def get_chat_status(gid: int) -> bool:
-    """Get chat on/off status for a group"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT chat_on FROM groups WHERE gid = ?", (gid,)) as cursor:
-            row = await cursor.fetchone()
-            return bool(row[0]) if row else True
+    """Get chat on/off status for a group (served from memory)"""
+    group = _groups.get(gid)
+    return group["chat_on"] if group else True
 
-async def get_all_groups() -> List[Dict]:
-    """Get all groups for broadcasting and listing"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM groups") as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+async def iter_groups(columns: tuple = ("gid",), batch_size: int = PAGE_SIZE) -> AsyncIterator[Dict]:
+    """Stream groups in gid order, fetching only the requested columns"""
+    async for row in _iter_table("groups", "gid", columns, batch_size):
+        yield row
 
 # ==================== ADMIN OPERATIONS ====================
 
+# Admin roster: an immutable set swapped as a whole on every change, plus
+# the admins_version counter it was loaded at. Other processes sharing the
+# database bump the same counter, so the sync task spots stale copies.
+_admins: frozenset = frozenset()
+_admins_version = 0
+_admin_sync_task: Optional[asyncio.Task] = None
+
+ADMINS_VERSION_SQL = "SELECT value FROM counters WHERE name = 'admins_version'"
+
+async def _read_admins_version(db: aiosqlite.Connection) -> int:
+    async with db.execute(ADMINS_VERSION_SQL) as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+async def _bump_admins_version(db: aiosqlite.Connection) -> int:
+    await db.execute("""
+        INSERT INTO counters (name, value) VALUES ('admins_version', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1
+    """)
+    return await _read_admins_version(db)
+
+async def refresh_admins(force: bool = False) -> bool:
+    """Reload the admin set if the stored version moved. Returns True if reloaded."""
+    global _admins, _admins_version
+    async with _read() as db:
+        version = await _read_admins_version(db)
+        if not force and version == _admins_version:
+            return False
+        async with db.execute("SELECT uid FROM admins") as cursor:
+            uids = frozenset(row[0] for row in await cursor.fetchall())
+    
+    _admins, _admins_version = uids, version
+    return True
+
 async def add_admin(uid: int, promoted_by: int):
     """Add new bot admin"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    global _admins, _admins_version
+    async with _write() as db:
         await db.execute("""
             INSERT OR REPLACE INTO admins (uid, promoted_by, promoted_at)
             VALUES (?, ?, ?)
         """, (uid, promoted_by, datetime.now()))
-        await db.commit()
+        version = await _bump_admins_version(db)
+    
+    _admins, _admins_version = _admins | {uid}, version
 
 async def remove_admin(uid: int):
     """Remove bot admin"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    global _admins, _admins_version
+    async with _write() as db:
         await db.execute("DELETE FROM admins WHERE uid = ?", (uid,))
-        await db.commit()
+        version = await _bump_admins_version(db)
+    
+    _admins, _admins_version = _admins - {uid}, version
 
 async def is_bot_admin(uid: int) -> bool:
-    """Check if user is bot admin"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT uid FROM admins WHERE uid = ?", (uid,)) as cursor:
-            row = await cursor.fetchone()
-            return row is not None
+    """Check if user is bot admin (served from memory)"""
+    return uid in _admins
+
+async def _admin_sync_loop():
+    while True:
+        await asyncio.sleep(ADMIN_SYNC_INTERVAL)
+        try:
+            if await refresh_admins():
+                print(f"🔄 Admin list reloaded (version {_admins_version})")
+        except Exception as e:
+            print(f"❌ Admin sync failed: {e}")
 
 async def get_all_admins() -> List[Dict]:
     """Get all bot admins"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         async with db.execute("SELECT * FROM admins") as cursor:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
@@ -217,95 +1021,577 @@ async def get_all_admins() -> List[Dict]:
 # ==================== USAGE LOGS ====================
 
 async def log_usage(uid: int, gid: Optional[int] = None, cmd: Optional[str] = None, qtext: Optional[str] = None):
-    """Log command or question usage"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            INSERT INTO usage_logs (uid, gid, cmd, qtext, ts)
-            VALUES (?, ?, ?, ?, ?)
-        """, (uid, gid, cmd, qtext, datetime.now()))
-        await db.commit()
+    """Log command or question usage (buffered)"""
+    _write_behind.add_log(uid, gid, cmd, qtext)
+
+DAILY_ACTIVE_SQL = "SELECT users FROM daily_active WHERE day = ?"
+QUERIES_SINCE_SQL = "SELECT COALESCE(SUM(count), 0) FROM usage_hourly WHERE hour >= ?"
+TOP_COMMANDS_SQL = """
+    SELECT cmd, SUM(count) AS total FROM usage_daily
+    WHERE day = ?
+    GROUP BY cmd ORDER BY total DESC LIMIT 5
+"""
+TOP_GROUPS_SQL = """
+    SELECT d.gid, g.title, SUM(d.count) AS total FROM usage_daily d
+    LEFT JOIN groups g ON g.gid = d.gid
+    WHERE d.day = ? AND d.gid != 0
+    GROUP BY d.gid ORDER BY total DESC LIMIT 5
+"""
 
 async def get_stats() -> Dict[str, Any]:
-    """Get bot statistics"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Total users
-        async with db.execute("SELECT COUNT(*) FROM users") as cursor:
-            row = await cursor.fetchone()
-            total_users = row[0] if row else 0
+    """
+    Get bot statistics from the rollup tables
+    Daily active users and breakdowns cover the current day
+    """
+    await _write_behind.flush()
+    now = datetime.now()
+    today = now.strftime(DAY_FORMAT)
+    since_hour = (now - timedelta(hours=23)).strftime(HOUR_FORMAT)
+    
+    async with _read() as db:
+        async with db.execute("SELECT name, value FROM counters") as cursor:
+            counters = {row[0]: row[1] for row in await cursor.fetchall()}
         
-        # Total groups
-        async with db.execute("SELECT COUNT(*) FROM groups") as cursor:
+        async with db.execute(DAILY_ACTIVE_SQL, (today,)) as cursor:
             row = await cursor.fetchone()
-            total_groups = row[0] if row else 0
+            daily_active = row[0] if row else 0
         
-        # Total queries
-        async with db.execute("SELECT COUNT(*) FROM usage_logs") as cursor:
+        async with db.execute(QUERIES_SINCE_SQL, (since_hour,)) as cursor:
             row = await cursor.fetchone()
-            total_queries = row[0] if row else 0
+            queries_24h = row[0] if row else 0
         
-        # Daily active users (last 24 hours)
-        async with db.execute("""
-            SELECT COUNT(DISTINCT uid) FROM usage_logs
-            WHERE ts >= datetime('now', '-1 day')
-        """) as cursor:
-            row = await cursor.fetchone()
-            daily_active = row[0] if row else 0
+        # Per-command and per-group breakdowns for today
+        async with db.execute(TOP_COMMANDS_SQL, (today,)) as cursor:
+            top_commands = [(row[0] or "-", row[1]) for row in await cursor.fetchall()]
+        
+        async with db.execute(TOP_GROUPS_SQL, (today,)) as cursor:
+            top_groups = [(row[1] or str(row[0]), row[2]) for row in await cursor.fetchall()]
         
         return {
-            "total_users": total_users,
-            "total_groups": total_groups,
-            "total_queries": total_queries,
-            "daily_active_users": daily_active
+            "total_users": counters.get("total_users", 0),
+            "total_groups": counters.get("total_groups", 0),
+            "total_queries": counters.get("total_queries", 0),
+            "daily_active_users": daily_active,
+            "queries_24h": queries_24h,
+            "top_commands": top_commands,
+            "top_groups": top_groups
         }
 
+# ==================== RETENTION & ARCHIVAL ====================
+# Old usage_logs rows are moved into one SQLite file per month under
+# ARCHIVE_DIR (archive/usage_logs_YYYY_MM.db) in small batches, so the hot
+# database and /dumpdb stay small. Stats rollups are not touched, so
+# /stats totals keep including archived rows.
+
+_retention_task: Optional[asyncio.Task] = None
+# Held by a rollup rebuild from its usage_logs pass until the archives are
+# merged, so no batch moves rows in between and gets counted twice
+_rollup_rebuild_lock = asyncio.Lock()
+
+def archive_path(month: str) -> str:
+    """Archive file for a 'YYYY-MM' month"""
+    return os.path.join(ARCHIVE_DIR, f"usage_logs_{month.replace('-', '_')}.db")
+
+def archive_files() -> List[str]:
+    """All monthly archive files, oldest first"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(
+        os.path.join(ARCHIVE_DIR, name) for name in os.listdir(ARCHIVE_DIR)
+        if name.startswith("usage_logs_") and name.endswith(".db")
+    )
+
+def _next_month(month: str) -> str:
+    year, mon = int(month[:4]), int(month[5:7])
+    year, mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return f"{year:04d}-{mon:02d}-01"
+
+OLDEST_USAGE_LOG_SQL = "SELECT MIN(ts) FROM usage_logs"
+# Next batch to archive (main. because the archive file is attached meanwhile)
+ARCHIVE_BATCH_SQL = "SELECT id FROM main.usage_logs WHERE ts < ? ORDER BY ts LIMIT ?"
+
+async def archive_usage_batch(cutoff: datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """
+    Move up to `batch_size` of the oldest usage_logs rows older than `cutoff`
+    into their month's archive file. Returns the number of rows moved.
+    """
+    async with _read() as db:
+        async with db.execute(OLDEST_USAGE_LOG_SQL) as cursor:
+            row = await cursor.fetchone()
+    oldest = row[0] if row else None
+    if oldest is None or str(oldest) >= str(cutoff):
+        return 0
+    
+    # Stay inside one month per batch so every row lands in the same file
+    month = str(oldest)[:7]
+    upper = min(str(cutoff), _next_month(month))
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    
+    if _writer is None:
+        await open_pool()
+    
+    async with _rollup_rebuild_lock, _write_lock:
+        db = _writer
+        # ATTACH/DETACH are not allowed inside a transaction
+        await db.execute("ATTACH DATABASE ? AS archive", (archive_path(month),))
+        try:
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS archive.usage_logs (
+                    id INTEGER PRIMARY KEY,
+                    uid INTEGER,
+                    gid INTEGER,
+                    cmd TEXT,
+                    qtext TEXT,
+                    ts TIMESTAMP
+                )
+            """)
+            await db.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+            await db.execute("DELETE FROM temp.archive_batch")
+            cursor = await db.execute(
+                f"INSERT INTO temp.archive_batch (id) {ARCHIVE_BATCH_SQL}", (upper, batch_size)
+            )
+            moved = cursor.rowcount
+            
+            await db.execute("""
+                INSERT OR IGNORE INTO archive.usage_logs (id, uid, gid, cmd, qtext, ts)
+                SELECT id, uid, gid, cmd, qtext, ts FROM main.usage_logs
+                WHERE id IN (SELECT id FROM temp.archive_batch)
+            """)
+            await db.execute("""
+                DELETE FROM main.usage_logs WHERE id IN (SELECT id FROM temp.archive_batch)
+            """)
+            await db.execute("DELETE FROM temp.archive_batch")
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        finally:
+            await db.execute("DETACH DATABASE archive")
+    
+    return moved
+
+async def _prune_rollup_details(cutoff: datetime):
+    """Drop hourly counters and per-day user sets past the retention window"""
+    async with _write() as db:
+        await db.execute("DELETE FROM usage_hourly WHERE hour < ?", (cutoff.strftime(HOUR_FORMAT),))
+        await db.execute("DELETE FROM daily_users WHERE day < ?", (cutoff.strftime(DAY_FORMAT),))
+
+async def run_retention(retention_days: int = USAGE_LOG_RETENTION_DAYS) -> int:
+    """
+    Archive everything older than the retention window in bounded batches
+    Returns the total number of rows moved
+    """
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    total = 0
+    
+    while True:
+        moved = await archive_usage_batch(cutoff)
+        total += moved
+        if moved == 0:
+            break
+        # Give handlers a turn at the writer between batches
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+    
+    await _prune_rollup_details(cutoff)
+    
+    # Hand freed pages back to the OS (init_db made auto_vacuum incremental)
+    # in slices, with the same pauses as archiving
+    while True:
+        async with _write() as db:
+            # The pragma frees one page per step, so its cursor must be drained
+            async with db.execute("PRAGMA incremental_vacuum(1000)") as cursor:
+                await cursor.fetchall()
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                free_pages = (await cursor.fetchone())[0]
+        if free_pages == 0:
+            break
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+    
+    if total:
+        print(f"🗄️ Archived {total} usage log rows older than {retention_days} days")
+    return total
+
+async def _retention_loop():
+    while True:
+        try:
+            await run_retention()
+        except Exception as e:
+            print(f"❌ Usage log retention failed: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+def _start_retention():
+    global _retention_task
+    if USAGE_LOG_RETENTION_DAYS > 0 and _retention_task is None:
+        _retention_task = asyncio.create_task(_retention_loop())
+
+async def _stop_retention():
+    global _retention_task
+    if _retention_task is not None:
+        _retention_task.cancel()
+        try:
+            await _retention_task
+        except asyncio.CancelledError:
+            pass
+        _retention_task = None
+
+async def _merge_archived_rollups(path: str):
+    """Add one archive file's rows on top of the live rollups"""
+    async with aiosqlite.connect(path) as archive:
+        async with archive.execute(f"""
+            SELECT strftime('{HOUR_FORMAT}', ts), COALESCE(cmd, ''), COALESCE(gid, 0), COUNT(*)
+            FROM usage_logs GROUP BY 1, 2, 3
+        """) as cursor:
+            hourly = await cursor.fetchall()
+        async with archive.execute(f"""
+            SELECT strftime('{DAY_FORMAT}', ts), COALESCE(cmd, ''), COALESCE(gid, 0), COUNT(*)
+            FROM usage_logs GROUP BY 1, 2, 3
+        """) as cursor:
+            daily = await cursor.fetchall()
+        async with archive.execute(f"""
+            SELECT DISTINCT strftime('{DAY_FORMAT}', ts), uid FROM usage_logs
+        """) as cursor:
+            day_users = await cursor.fetchall()
+    
+    async with _write() as db:
+        await db.executemany("""
+            INSERT INTO usage_hourly (hour, cmd, gid, count) VALUES (?, ?, ?, ?)
+            ON CONFLICT(hour, cmd, gid) DO UPDATE SET count = count + excluded.count
+        """, hourly)
+        await db.executemany("""
+            INSERT INTO usage_daily (day, cmd, gid, count) VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, cmd, gid) DO UPDATE SET count = count + excluded.count
+        """, daily)
+        await db.executemany("INSERT OR IGNORE INTO daily_users (day, uid) VALUES (?, ?)", day_users)
+        await db.execute("""
+            UPDATE counters SET value = value + ? WHERE name = 'total_queries'
+        """, (sum(row[3] for row in daily),))
+
+# ==================== ANSWER CACHE ====================
+# Persistent tier of answer_cache.py: zlib-compressed JSON answers keyed by
+# a hash of the normalized question and mode. Stores and hit times go
+# through the write-behind queue; expired and least recently hit rows are
+# pruned once the table grows past ANSWER_CACHE_MAX_ROWS.
+
+# Row count as of the last prune plus rows written since (may overcount)
+_answer_rows = 0
+
+async def _create_answer_cache_table(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            key TEXT PRIMARY KEY,
+            mode TEXT NOT NULL,
+            question TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            created_at REAL NOT NULL,
+            last_hit REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_last_hit ON answer_cache(last_hit)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_created ON answer_cache(created_at)")
+
+CACHED_ANSWER_SQL = "SELECT payload FROM answer_cache WHERE key = ? AND created_at >= ?"
+CACHED_ANSWERS_PAGE_SQL = """
+    SELECT key, mode, question, created_at FROM answer_cache
+    WHERE (created_at, key) > (?, ?)
+    ORDER BY created_at, key LIMIT ?
+"""
+EXPIRE_ANSWERS_SQL = "DELETE FROM answer_cache WHERE created_at < ?"
+EVICT_ANSWERS_SQL = """
+    DELETE FROM answer_cache WHERE key IN (
+        SELECT key FROM answer_cache ORDER BY last_hit LIMIT ?
+    )
+"""
+
+async def get_cached_answer(key: str) -> Optional[bytes]:
+    """Compressed payload of a live cached answer, or None"""
+    async with _read() as db:
+        async with db.execute(CACHED_ANSWER_SQL, (key, time.time() - ANSWER_CACHE_TTL)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+def store_cached_answer(key: str, mode: str, question: str, payload: bytes):
+    """Queue an answer for the persistent cache"""
+    _write_behind.add_answer(key, mode, question, payload)
+
+def touch_cached_answer(key: str):
+    """Queue a hit so the answer is evicted last"""
+    _write_behind.add_answer_hit(key)
+
+async def iter_cached_answers(since: float = 0.0, batch_size: int = PAGE_SIZE) -> AsyncIterator[Dict]:
+    """Yield cached answers (key, mode, question, created_at) stored after `since`, oldest first"""
+    last = (since, "")
+    while True:
+        async with _read() as db:
+            async with db.execute(CACHED_ANSWERS_PAGE_SQL, last + (batch_size,)) as cursor:
+                rows = await cursor.fetchall()
+        
+        for row in rows:
+            yield dict(row)
+        
+        if len(rows) < batch_size:
+            return
+        last = (rows[-1]["created_at"], rows[-1]["key"])
+
+def answer_cache_rows() -> int:
+    return _answer_rows
+
+async def _note_answer_rows(added: int):
+    global _answer_rows
+    _answer_rows += added
+    if _answer_rows > ANSWER_CACHE_MAX_ROWS:
+        await prune_answer_cache()
+
+async def prune_answer_cache() -> int:
+    """
+    Drop expired answers, then the least recently hit ones down to 90% of
+    ANSWER_CACHE_MAX_ROWS. Returns the number of rows removed
+    """
+    global _answer_rows
+    async with _write() as db:
+        cursor = await db.execute(EXPIRE_ANSWERS_SQL, (time.time() - ANSWER_CACHE_TTL,))
+        removed = cursor.rowcount
+        
+        async with db.execute("SELECT COUNT(*) FROM answer_cache") as cursor:
+            rows = (await cursor.fetchone())[0]
+        
+        excess = rows - int(ANSWER_CACHE_MAX_ROWS * 0.9) if rows > ANSWER_CACHE_MAX_ROWS else 0
+        if excess > 0:
+            await db.execute(EVICT_ANSWERS_SQL, (excess,))
+            removed += excess
+            rows -= excess
+    
+    _answer_rows = rows
+    if removed:
+        print(f"🧹 Pruned {removed} cached answers ({rows} left)")
+    return removed
+
+# ==================== IMAGE ANSWER CACHE ====================
+# Persistent tier of image_cache.py: compressed answers to photo questions
+# keyed by Telegram's file_unique_id, with the photo's perceptual hash
+# (NULL for copies that were matched to another photo by hash). Same
+# write-behind and pruning scheme as the answer cache.
+
+_image_rows = 0
+
+async def _create_image_cache_table(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS image_cache (
+            file_unique_id TEXT PRIMARY KEY,
+            phash BLOB,
+            payload BLOB NOT NULL,
+            created_at REAL NOT NULL,
+            last_hit REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_image_cache_last_hit ON image_cache(last_hit)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_image_cache_created ON image_cache(created_at)")
+
+CACHED_IMAGE_ANSWER_SQL = "SELECT payload FROM image_cache WHERE file_unique_id = ? AND created_at >= ?"
+IMAGE_HASHES_PAGE_SQL = """
+    SELECT file_unique_id, phash, created_at FROM image_cache
+    WHERE (created_at, file_unique_id) > (?, ?)
+    ORDER BY created_at, file_unique_id LIMIT ?
+"""
+EXPIRE_IMAGES_SQL = "DELETE FROM image_cache WHERE created_at < ?"
+EVICT_IMAGES_SQL = """
+    DELETE FROM image_cache WHERE file_unique_id IN (
+        SELECT file_unique_id FROM image_cache ORDER BY last_hit LIMIT ?
+    )
+"""
+
+async def get_cached_image_answer(file_unique_id: str) -> Optional[bytes]:
+    """Compressed payload of a live cached photo answer, or None"""
+    async with _read() as db:
+        async with db.execute(CACHED_IMAGE_ANSWER_SQL, (file_unique_id, time.time() - IMAGE_CACHE_TTL)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+def store_cached_image_answer(file_unique_id: str, phash: Optional[bytes], payload: bytes):
+    """Queue a photo answer for the persistent cache"""
+    _write_behind.add_image(file_unique_id, phash, payload)
+
+def touch_cached_image_answer(file_unique_id: str):
+    """Queue a hit so the photo answer is evicted last"""
+    _write_behind.add_image_hit(file_unique_id)
+
+async def iter_image_hashes(batch_size: int = PAGE_SIZE) -> AsyncIterator[Tuple[str, bytes]]:
+    """Yield (file_unique_id, phash) of live cached photo answers that have a hash"""
+    last = (time.time() - IMAGE_CACHE_TTL, "")
+    while True:
+        async with _read() as db:
+            async with db.execute(IMAGE_HASHES_PAGE_SQL, last + (batch_size,)) as cursor:
+                rows = await cursor.fetchall()
+        
+        for row in rows:
+            if row["phash"] is not None:
+                yield row["file_unique_id"], row["phash"]
+        
+        if len(rows) < batch_size:
+            return
+        last = (rows[-1]["created_at"], rows[-1]["file_unique_id"])
+
+def image_cache_rows() -> int:
+    return _image_rows
+
+async def _note_image_rows(added: int):
+    global _image_rows
+    _image_rows += added
+    if _image_rows > IMAGE_CACHE_MAX_ROWS:
+        await prune_image_cache()
+
+async def prune_image_cache() -> int:
+    """
+    Drop expired photo answers, then the least recently hit ones down to
+    90% of IMAGE_CACHE_MAX_ROWS. Returns the number of rows removed
+    """
+    global _image_rows
+    async with _write() as db:
+        cursor = await db.execute(EXPIRE_IMAGES_SQL, (time.time() - IMAGE_CACHE_TTL,))
+        removed = cursor.rowcount
+        
+        async with db.execute("SELECT COUNT(*) FROM image_cache") as cursor:
+            rows = (await cursor.fetchone())[0]
+        
+        excess = rows - int(IMAGE_CACHE_MAX_ROWS * 0.9) if rows > IMAGE_CACHE_MAX_ROWS else 0
+        if excess > 0:
+            await db.execute(EVICT_IMAGES_SQL, (excess,))
+            removed += excess
+            rows -= excess
+    
+    _image_rows = rows
+    if removed:
+        print(f"🧹 Pruned {removed} cached photo answers ({rows} left)")
+    return removed
+
 # ==================== FORCE JOIN ====================
 
+# Cached force join list; None means it must be re-read
+_force_join_chats: Optional[List[Dict]] = None
+_force_join_loaded_at = 0.0
+
+def _invalidate_force_join():
+    global _force_join_chats
+    _force_join_chats = None
+
 async def add_force_join(chat_id: int, chat_type: str, chat_title: str, chat_username: str, added_by: int):
-    """Add force join chat"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Add force join chat (re-adding a chat updates it)"""
+    async with _write() as db:
         await db.execute("""
             INSERT INTO force_join (chat_id, chat_type, chat_title, chat_username, added_by, added_at)
             VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                chat_type = excluded.chat_type,
+                chat_title = excluded.chat_title,
+                chat_username = excluded.chat_username,
+                added_by = excluded.added_by,
+                added_at = excluded.added_at
         """, (chat_id, chat_type, chat_title, chat_username, added_by, datetime.now()))
-        await db.commit()
+    
+    _invalidate_force_join()
+
+REMOVE_FORCE_JOIN_SQL = "DELETE FROM force_join WHERE chat_id = ?"
 
 async def remove_force_join(chat_id: int):
     """Remove force join chat"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM force_join WHERE chat_id = ?", (chat_id,))
-        await db.commit()
+    async with _write() as db:
+        await db.execute(REMOVE_FORCE_JOIN_SQL, (chat_id,))
+    
+    _invalidate_force_join()
 
 async def get_force_join_chats() -> List[Dict]:
-    """Get all force join chats"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM force_join") as cursor:
+    """Get all force join chats (cached; do not mutate the returned dicts)"""
+    global _force_join_chats, _force_join_loaded_at
+    if _force_join_chats is not None and time.monotonic() - _force_join_loaded_at < FORCE_JOIN_CACHE_TTL:
+        return _force_join_chats
+    
+    async with _read() as db:
+        async with db.execute("SELECT * FROM force_join ORDER BY id") as cursor:
             rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    
+    _force_join_chats = [dict(row) for row in rows]
+    _force_join_loaded_at = time.monotonic()
+    return _force_join_chats
 
 # ==================== PENDING MESSAGES ====================
 
 async def save_pending_message(uid: int, message_id: int, chat_id: int):
     """Save pending force join prompt message"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("""
             INSERT OR REPLACE INTO pending_prompt_messages (uid, message_id, chat_id)
             VALUES (?, ?, ?)
         """, (uid, message_id, chat_id))
-        await db.commit()
-
-async def get_pending_message(uid: int) -> Optional[Dict]:
-    """Get pending message for user"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT * FROM pending_prompt_messages WHERE uid = ?
-        """, (uid,)) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    
+    profile = _user_cache.get(uid)
+    if profile is not None:
+        profile["pending"] = {"uid": uid, "message_id": message_id, "chat_id": chat_id}
+
+DELETE_PENDING_MESSAGE_SQL = "DELETE FROM pending_prompt_messages WHERE uid = ?"
 
 async def delete_pending_message(uid: int):
     """Delete pending message after user joins"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM pending_prompt_messages WHERE uid = ?", (uid,))
-        await db.commit()
+    async with _write() as db:
+        await db.execute(DELETE_PENDING_MESSAGE_SQL, (uid,))
+    
+    profile = _user_cache.get(uid)
+    if profile is not None:
+        profile["pending"] = None
+
+# ==================== QUERY PLAN CHECK ====================
+
+# Every lookup query that must be served by an index, with sample
+# parameters. The SQL is the same constant the function runs, so the check
+# cannot drift from the code; tests/test_query_plans.py fails when one of
+# them falls back to a full table scan, and init_db prints a warning.
+# Full listings (get_all_admins, get_force_join_chats, ...) are intentionally absent.
+PLANNED_QUERIES = {
+    "admins_version": (ADMINS_VERSION_SQL, ()),
+    "daily_active_users": (DAILY_ACTIVE_SQL, ("",)),
+    "queries_24h": (QUERIES_SINCE_SQL, ("",)),
+    "top_commands": (TOP_COMMANDS_SQL, ("",)),
+    "top_groups": (TOP_GROUPS_SQL, ("",)),
+    "remove_force_join": (REMOVE_FORCE_JOIN_SQL, (0,)),
+    "load_user_context": (USER_CONTEXT_SQL, (0,)),
+    "delete_pending_message": (DELETE_PENDING_MESSAGE_SQL, (0,)),
+    "oldest_usage_log": (OLDEST_USAGE_LOG_SQL, ()),
+    "archive_usage_batch": (ARCHIVE_BATCH_SQL, ("", 1)),
+    "iter_users": (ITER_TABLE_SQL.format(select="uid", table="users", key="uid"), (0, 1)),
+    "iter_groups": (ITER_TABLE_SQL.format(select="gid", table="groups", key="gid"), (0, 1)),
+    "get_cached_answer": (CACHED_ANSWER_SQL, ("", 0.0)),
+    "iter_cached_answers": (CACHED_ANSWERS_PAGE_SQL, (0.0, "", 1)),
+    "expire_answers": (EXPIRE_ANSWERS_SQL, (0.0,)),
+    "evict_answers": (EVICT_ANSWERS_SQL, (1,)),
+    "touch_cached_answer": (ANSWER_HIT_SQL, (0.0, "")),
+    "get_cached_image_answer": (CACHED_IMAGE_ANSWER_SQL, ("", 0.0)),
+    "iter_image_hashes": (IMAGE_HASHES_PAGE_SQL, (0.0, "", 1)),
+    "expire_images": (EXPIRE_IMAGES_SQL, (0.0,)),
+    "evict_images": (EVICT_IMAGES_SQL, (1,)),
+    "touch_cached_image_answer": (IMAGE_HIT_SQL, (0.0, "")),
+    "increment_user_questions": (INCREMENT_QUESTIONS_SQL, (1, 0)),
+}
+
+# Queries that walk an index in order and stop at their LIMIT: a SCAN is
+# fine for them as long as it goes through an index
+INDEX_ORDER_QUERIES = {"evict_answers", "evict_images"}
+
+async def explain(sql: str, params: tuple = ()) -> List[str]:
+    """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+    async with _read() as db:
+        async with db.execute(f"EXPLAIN QUERY PLAN {sql}", params) as cursor:
+            rows = await cursor.fetchall()
+            return [row[3] for row in rows]
+
+async def check_query_plans() -> List[str]:
+    """
+    Verify that no planned query does a full table scan
+    Returns a list of problems (empty when all plans use an index)
+    """
+    problems = []
+    for name, (sql, params) in PLANNED_QUERIES.items():
+        for detail in await explain(sql, params):
+            if not detail.startswith("SCAN") or detail == "SCAN CONSTANT ROW":
+                continue
+            if name in INDEX_ORDER_QUERIES and " USING " in detail and " INDEX " in detail:
+                continue
+            problems.append(f"{name}: {detail}")
+    return problems
@@ -4,6 +4,7 @@ Personal chat handlers for the bot
 """
 
 import os
+from typing import Optional
 from pyrogram import filters
 from pyrogram.client import Client
 from pyrogram.types import Message
@@ -12,11 +13,45 @@ from pyrogram.errors import FloodWait
 import asyncio
 import db
 import utils
-from apiclient import api_client
+from apiclient import api_client, PRIORITY_ADMIN, PRIORITY_PRIVATE
+from cache import TTLCache
+from context import UserContext, with_user_context
+from spool import spool
 
-OWNER_ID = int(os.getenv("OWNER_ID", "0"))
+# Force join membership results per (uid, chat_id): members are trusted for
+# longer than non-members so someone who just joined is let in quickly
+FORCE_JOIN_MEMBER_TTL = float(os.getenv("FORCE_JOIN_MEMBER_TTL", "600"))
+FORCE_JOIN_NON_MEMBER_TTL = float(os.getenv("FORCE_JOIN_NON_MEMBER_TTL", "30"))
+_membership_cache = TTLCache(
+    int(os.getenv("FORCE_JOIN_CACHE_SIZE", "100000")),
+    FORCE_JOIN_MEMBER_TTL,
+    name="force_join_members"
+)
 
-async def check_force_join(client: Client, message: Message) -> bool:
+async def is_chat_member(client: Client, chat_id: int, uid: int) -> Optional[bool]:
+    """
+    Cached membership check
+    Returns None when Telegram could not tell (not cached, not blocking)
+    """
+    cached = _membership_cache.get((uid, chat_id))
+    if cached is not None:
+        return cached
+    
+    try:
+        member = await client.get_chat_member(chat_id, uid)
+    except Exception as e:
+        print(f"Error checking membership: {e}")
+        return None
+    
+    is_member = member.status not in ["left", "kicked"]
+    _membership_cache.set(
+        (uid, chat_id),
+        is_member,
+        ttl=FORCE_JOIN_MEMBER_TTL if is_member else FORCE_JOIN_NON_MEMBER_TTL
+    )
+    return is_member
+
+async def check_force_join(client: Client, message: Message, ctx: UserContext) -> bool:
     """
     Check if user has joined required force join chats
     Returns True if all checks passed, False if blocked
@@ -27,66 +62,58 @@ async def check_force_join(client: Client, message: Message) -> bool:
         return True
     
     # Owner bypasses force join
-    if message.from_user.id == OWNER_ID:
+    if ctx.is_owner:
         return True
     
-    # Check membership in all force join chats
-    for chat in force_chats:
-        try:
-            member = await client.get_chat_member(chat['chat_id'], message.from_user.id)
+    # Check membership in all force join chats at once
+    results = await asyncio.gather(*[
+        is_chat_member(client, chat['chat_id'], message.from_user.id)
+        for chat in force_chats
+    ])
+    
+    for chat, is_member in zip(force_chats, results):
+        # If user is kicked or left, block them
+        if is_member is False:
+            # Send force join message
+            user_name = message.from_user.first_name or "दोस्त"
+            chat_title = chat.get('chat_title', 'Required Group')
+            chat_username = chat.get('chat_username', '')
             
-            # If user is kicked or left, block them
-            if member.status in ["left", "kicked"]:
-                # Send force join message
-                user_name = message.from_user.first_name or "दोस्त"
-                chat_title = chat.get('chat_title', 'Required Group')
-                chat_username = chat.get('chat_username', '')
-                
-                force_msg = utils.format_force_join_message(chat_title, user_name)
-                keyboard = utils.get_force_join_button(chat_username, chat_title, chat['chat_type'])
-                
-                # Send branded message
-                sent_msg = await message.reply_text(
-                    force_msg,
-                    reply_markup=keyboard
-                )
-                
-                # Save message ID for later deletion
-                await db.save_pending_message(message.from_user.id, sent_msg.id, message.chat.id)
-                
-                return False
-        
-        except Exception as e:
-            print(f"Error checking membership: {e}")
-            continue
+            force_msg = utils.format_force_join_message(chat_title, user_name)
+            keyboard = utils.get_force_join_button(chat_username, chat_title, chat['chat_type'])
+            
+            # Send branded message
+            sent_msg = await message.reply_text(
+                force_msg,
+                reply_markup=keyboard
+            )
+            
+            # Save message ID for later deletion
+            await db.save_pending_message(message.from_user.id, sent_msg.id, message.chat.id)
+            
+            return False
     
     # Delete any pending force join messages if user has joined
-    pending = await db.get_pending_message(message.from_user.id)
+    pending = ctx.pending
     if pending:
         try:
             await client.delete_messages(pending['chat_id'], pending['message_id'])
             await db.delete_pending_message(message.from_user.id)
+            ctx.pending = None
         except:
             pass
     
     return True
 
-async def lang_handler(client: Client, message: Message):
+@with_user_context
+async def lang_handler(client: Client, message: Message, ctx: UserContext):
     """
     Handle /lang command - let user choose language
     """
     from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     
-    # Add/update user
-    await db.add_or_update_user(
-        uid=message.from_user.id,
-        username=message.from_user.username,
-        first_name=message.from_user.first_name,
-        last_name=message.from_user.last_name
-    )
-    
     # Get current language
-    current_lang = await db.get_user_language(message.from_user.id)
+    current_lang = ctx.language
     
     # Language selection buttons
     keyboard = InlineKeyboardMarkup([
@@ -104,31 +131,23 @@ Please select your preferred language:
     
     await message.reply_text(lang_text, reply_markup=keyboard)
 
-async def start_handler(client: Client, message: Message):
+@with_user_context
+async def start_handler(client: Client, message: Message, ctx: UserContext):
     """
     Handle /start command in private chat
     Send welcome message with features and inline buttons
     """
     print(f"✅ START HANDLER CALLED by user {message.from_user.id}")
     
-    # Add/update user in database
-    await db.add_or_update_user(
-        uid=message.from_user.id,
-        username=message.from_user.username,
-        first_name=message.from_user.first_name,
-        last_name=message.from_user.last_name
-    )
-    
     # Check force join
-    if not await check_force_join(client, message):
+    if not await check_force_join(client, message, ctx):
         print(f"⚠️ Force join check failed for user {message.from_user.id}")
         return
     
     # Log usage
     await db.log_usage(message.from_user.id, cmd="/start")
     
-    # Get user's language
-    user_lang = await db.get_user_language(message.from_user.id)
+    user_lang = ctx.language
     
     # Send welcome message
     welcome_text = utils.format_start_message(user_lang)
@@ -141,29 +160,22 @@ async def start_handler(client: Client, message: Message):
     )
     print(f"✅ Welcome message sent successfully!")
 
-async def question_handler(client: Client, message: Message):
+@with_user_context
+async def question_handler(client: Client, message: Message, ctx: UserContext):
     """
     Handle text questions in private chat
-    Call API and send short answer with detailed solution button
+    Call API and show the short answer (streamed in when the API supports
+    it) with detailed solution button in the processing message
     """
     # Skip if message is a command (starts with /)
     if message.text.startswith('/'):
         return
     
-    # Add/update user
-    await db.add_or_update_user(
-        uid=message.from_user.id,
-        username=message.from_user.username,
-        first_name=message.from_user.first_name,
-        last_name=message.from_user.last_name
-    )
-    
     # Check force join
-    if not await check_force_join(client, message):
+    if not await check_force_join(client, message, ctx):
         return
     
-    # Get user's language
-    user_lang = await db.get_user_language(message.from_user.id)
+    user_lang = ctx.language
     
     # Validate question length
     if len(message.text) > 2000:
@@ -174,15 +186,15 @@ async def question_handler(client: Client, message: Message):
     processing_msg = await message.reply_text(utils.get_message("finding_answer", user_lang))
     
     try:
-        # Get answer from API
-        result = await api_client.get_answer(
-            question=message.text,
-            uid=message.from_user.id,
-            mode="short"
-        )
-        
-        # Delete processing message
-        await processing_msg.delete()
+        # Get answer from API, showing it as it streams in
+        async with utils.LiveAnswer(processing_msg, message.text, user_lang) as live:
+            result = await api_client.get_answer(
+                question=message.text,
+                uid=message.from_user.id,
+                mode="short",
+                priority=PRIORITY_ADMIN if ctx.is_admin else PRIORITY_PRIVATE,
+                on_progress=live.update
+            )
         
         if result.get('success'):
             # Format answer
@@ -195,8 +207,8 @@ async def question_handler(client: Client, message: Message):
             # Create solution button
             solution_button = utils.get_solution_button(result['detailed_url'])
             
-            # Send answer
-            await message.reply_text(
+            # Replace the processing message with the answer
+            await processing_msg.edit_text(
                 answer_text,
                 reply_markup=solution_button
             )
@@ -210,7 +222,7 @@ async def question_handler(client: Client, message: Message):
             await db.increment_user_questions(message.from_user.id)
         
         else:
-            await message.reply_text(utils.get_message("error_occurred", user_lang))
+            await processing_msg.edit_text(utils.get_message("error_occurred", user_lang))
     
     except FloodWait as e:
         await asyncio.sleep(e.value)
@@ -223,38 +235,38 @@ async def question_handler(client: Client, message: Message):
         await processing_msg.delete()
         await message.reply_text(utils.get_message("error_occurred", user_lang))
 
-async def image_handler(client: Client, message: Message):
+@with_user_context
+async def image_handler(client: Client, message: Message, ctx: UserContext):
     """
     Handle image questions in private chat
-    Download image and call API
+    Download image (in memory) and call API
     """
-    # Add/update user
-    await db.add_or_update_user(
-        uid=message.from_user.id,
-        username=message.from_user.username,
-        first_name=message.from_user.first_name,
-        last_name=message.from_user.last_name
-    )
-    
     # Check force join
-    if not await check_force_join(client, message):
+    if not await check_force_join(client, message, ctx):
         return
     
-    # Get user's language
-    user_lang = await db.get_user_language(message.from_user.id)
+    user_lang = ctx.language
     
     # Send processing message
     processing_msg = await message.reply_text(utils.get_message("processing_image", user_lang))
     
     try:
-        # Download image
-        file_path = await message.download()
-        
-        # Get answer from API
-        result = await api_client.get_image_answer(file_path, message.from_user.id)
+        # Forwarded copies of a photo share file_unique_id: answer from
+        # the cache without downloading
+        file_unique_id = message.photo.file_unique_id
+        result = await api_client.get_cached_image_answer(file_unique_id)
         
-        # Delete processing message
-        await processing_msg.delete()
+        if result is None:
+            # Download image (in memory, or spooled for big photos; the
+            # spooled file is deleted as soon as the answer is in)
+            async with spool.download(message) as photo:
+                # Get answer from API
+                result = await api_client.get_image_answer(
+                    photo,
+                    message.from_user.id,
+                    priority=PRIORITY_ADMIN if ctx.is_admin else PRIORITY_PRIVATE,
+                    file_unique_id=file_unique_id
+                )
         
         if result.get('success'):
             # Format answer
@@ -267,8 +279,8 @@ async def image_handler(client: Client, message: Message):
             # Create solution button
             solution_button = utils.get_solution_button(result['detailed_url'])
             
-            # Send answer
-            await message.reply_text(
+            # Replace the processing message with the answer
+            await processing_msg.edit_text(
                 answer_text,
                 reply_markup=solution_button
             )
@@ -282,7 +294,7 @@ async def image_handler(client: Client, message: Message):
             await db.increment_user_questions(message.from_user.id)
         
         else:
-            await message.reply_text(utils.get_message("image_error", user_lang))
+            await processing_msg.edit_text(utils.get_message("image_error", user_lang))
     
     except Exception as e:
         print(f"Error in image handler: {e}")
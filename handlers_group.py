@@ -12,7 +12,7 @@ from pyrogram.errors import FloodWait
 import asyncio
 import db
 import utils
-from apiclient import api_client
+from apiclient import api_client, PRIORITY_ADMIN, PRIORITY_SOL, PRIORITY_PASSIVE
 
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
 
@@ -70,6 +70,8 @@ async def sol_command_handler(client: Client, message: Message):
         )
         return
     
+    await db.ensure_group(message.chat.id, message.chat.title, message.chat.username)
+    
     # Get the question from replied message
     replied_msg = message.reply_to_message
     question_text = replied_msg.text or replied_msg.caption or ""
@@ -93,14 +95,17 @@ async def sol_command_handler(client: Client, message: Message):
     
     try:
         # Get answer from API
-        result = await api_client.get_answer(
-            question=question_text,
-            uid=message.from_user.id,
-            mode="short"
-        )
-        
-        # Delete processing message
-        await processing_msg.delete()
+        uid = message.from_user.id
+        is_admin = uid == OWNER_ID or await db.is_bot_admin(uid)
+        async with utils.LiveAnswer(processing_msg, question_text,
+                                    interval=utils.ANSWER_EDIT_INTERVAL_GROUP) as live:
+            result = await api_client.get_answer(
+                question=question_text,
+                uid=uid,
+                mode="short",
+                priority=PRIORITY_ADMIN if is_admin else PRIORITY_SOL,
+                on_progress=live.update
+            )
         
         if result.get('success'):
             # Format answer for group
@@ -112,8 +117,8 @@ async def sol_command_handler(client: Client, message: Message):
             # Create solution button
             solution_button = utils.get_solution_button(result['detailed_url'])
             
-            # Send answer as reply to original question
-            await replied_msg.reply_text(
+            # Replace the processing message with the answer
+            await processing_msg.edit_text(
                 answer_text,
                 reply_markup=solution_button
             )
@@ -127,7 +132,7 @@ async def sol_command_handler(client: Client, message: Message):
             )
         
         else:
-            await message.reply_text(
+            await processing_msg.edit_text(
                 "❌ क्षमा करें, कुछ गड़बड़ हुई। फिर से try करें।"
             )
     
@@ -145,15 +150,19 @@ async def chaton_handler(client: Client, message: Message):
     Handle /chaton command - enable free chat in group
     Only for group admins or bot admins
     """
-    # Check if user is group admin or bot admin
-    is_admin = await is_group_admin(client, message.chat.id, message.from_user.id)
-    is_bot_admin = await db.is_bot_admin(message.from_user.id)
+    # Owner and bot admins are checked in memory before asking Telegram
+    is_admin = (
+        message.from_user.id == OWNER_ID
+        or await db.is_bot_admin(message.from_user.id)
+        or await is_group_admin(client, message.chat.id, message.from_user.id)
+    )
     
-    if not is_admin and not is_bot_admin and message.from_user.id != OWNER_ID:
+    if not is_admin:
         await message.reply_text("❌ Only group admins can use this command.")
         return
     
     # Enable chat
+    await db.ensure_group(message.chat.id, message.chat.title, message.chat.username)
     await db.set_chat_status(message.chat.id, True)
     await message.reply_text(
         "✅ **Chat Mode: ON**\n\n"
@@ -168,15 +177,19 @@ async def chatoff_handler(client: Client, message: Message):
     Handle /chatoff command - disable free chat in group
     Only for group admins or bot admins
     """
-    # Check if user is group admin or bot admin
-    is_admin = await is_group_admin(client, message.chat.id, message.from_user.id)
-    is_bot_admin = await db.is_bot_admin(message.from_user.id)
+    # Owner and bot admins are checked in memory before asking Telegram
+    is_admin = (
+        message.from_user.id == OWNER_ID
+        or await db.is_bot_admin(message.from_user.id)
+        or await is_group_admin(client, message.chat.id, message.from_user.id)
+    )
     
-    if not is_admin and not is_bot_admin and message.from_user.id != OWNER_ID:
+    if not is_admin:
         await message.reply_text("❌ Only group admins can use this command.")
         return
     
     # Disable chat
+    await db.ensure_group(message.chat.id, message.chat.title, message.chat.username)
     await db.set_chat_status(message.chat.id, False)
     await message.reply_text(
         "🔴 **Chat Mode: OFF**\n\n"
@@ -190,7 +203,10 @@ async def group_text_handler(client: Client, message: Message):
     """
     Handle normal text in groups (only if chat_on is True)
     """
-    # Check chat status
+    # Groups the bot joined while offline are registered on first sight
+    await db.ensure_group(message.chat.id, message.chat.title, message.chat.username)
+    
+    # Check chat status (in-memory, no I/O)
     chat_on = await db.get_chat_status(message.chat.id)
     
     if not chat_on:
@@ -214,13 +230,15 @@ async def group_text_handler(client: Client, message: Message):
     processing_msg = await message.reply_text("🔍 जवाब ढूंढ रहा हूं...")
     
     try:
-        result = await api_client.get_answer(
-            question=question_text,
-            uid=message.from_user.id,
-            mode="short"
-        )
-        
-        await processing_msg.delete()
+        async with utils.LiveAnswer(processing_msg, question_text,
+                                    interval=utils.ANSWER_EDIT_INTERVAL_GROUP) as live:
+            result = await api_client.get_answer(
+                question=question_text,
+                uid=message.from_user.id,
+                mode="short",
+                priority=PRIORITY_PASSIVE,
+                on_progress=live.update
+            )
         
         if result.get('success'):
             answer_text = utils.format_answer_message(
@@ -230,7 +248,7 @@ async def group_text_handler(client: Client, message: Message):
             
             solution_button = utils.get_solution_button(result['detailed_url'])
             
-            await message.reply_text(
+            await processing_msg.edit_text(
                 answer_text,
                 reply_markup=solution_button
             )
@@ -241,6 +259,9 @@ async def group_text_handler(client: Client, message: Message):
                 cmd="group_question",
                 qtext=question_text[:200]
             )
+        
+        else:
+            await processing_msg.delete()
     
     except Exception as e:
         print(f"Error in group text handler: {e}")
@@ -0,0 +1,221 @@
+"""
+Answer cache for photo questions
+The same question screenshots get forwarded thousands of times. Forwarded
+copies share Telegram's file_unique_id and are answered before anything is
+downloaded; re-uploaded or recompressed copies are matched by perceptual
+hash (images.py) against an in-memory index over db.image_cache.
+"""
+
+import os
+import json
+import zlib
+import asyncio
+from typing import Any, Dict, Optional, Set, Tuple
+import cache
+from cache import TTLCache
+import db
+from answer_cache import is_cacheable
+from images import HASH_SIZE
+
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "1") != "0"
+IMAGE_MEMORY_SIZE = int(os.getenv("IMAGE_MEMORY_SIZE", "2000"))
+IMAGE_MEMORY_TTL = float(os.getenv("IMAGE_MEMORY_TTL", "3600"))
+# Differing hash bits (out of 256) up to which two photos are the same page
+IMAGE_HASH_MAX_DISTANCE = int(os.getenv("IMAGE_HASH_MAX_DISTANCE", "24"))
+
+HASH_BITS = HASH_SIZE * HASH_SIZE
+BAND_BITS = 16
+BANDS = HASH_BITS // BAND_BITS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+class HashIndex:
+    """
+    Nearest perceptual hash by Hamming distance
+    Each hash is filed under its 16 16-bit bands; two hashes within 15 bits
+    share at least one band, so they are always compared, and hashes up to
+    IMAGE_HASH_MAX_DISTANCE apart almost always are.
+    """
+    
+    def __init__(self):
+        # band number -> band value -> file_unique_ids
+        self._bands = [dict() for _ in range(BANDS)]
+        self._hashes: Dict[str, int] = {}
+    
+    def __len__(self) -> int:
+        return len(self._hashes)
+    
+    @staticmethod
+    def _band_values(value: int):
+        for band in range(BANDS):
+            yield band, (value >> (band * BAND_BITS)) & BAND_MASK
+    
+    def add(self, file_unique_id: str, value: int):
+        if file_unique_id in self._hashes:
+            return
+        self._hashes[file_unique_id] = value
+        for band, band_value in self._band_values(value):
+            self._bands[band].setdefault(band_value, set()).add(file_unique_id)
+    
+    def remove(self, file_unique_id: str):
+        value = self._hashes.pop(file_unique_id, None)
+        if value is None:
+            return
+        for band, band_value in self._band_values(value):
+            bucket = self._bands[band].get(band_value)
+            if bucket is not None:
+                bucket.discard(file_unique_id)
+                if not bucket:
+                    del self._bands[band][band_value]
+    
+    def nearest(self, value: int, max_distance: int) -> Optional[Tuple[str, int]]:
+        """(file_unique_id, distance) of the closest hash within max_distance, or None"""
+        best: Optional[Tuple[str, int]] = None
+        seen: Set[str] = set()
+        for band, band_value in self._band_values(value):
+            for file_unique_id in self._bands[band].get(band_value, ()):
+                if file_unique_id in seen:
+                    continue
+                seen.add(file_unique_id)
+                distance = (self._hashes[file_unique_id] ^ value).bit_count()
+                if distance <= max_distance and (best is None or distance < best[1]):
+                    best = (file_unique_id, distance)
+        return best
+
+class ImageAnswerCache:
+    """In-memory LRU in front of db.image_cache, plus the perceptual hash index"""
+    
+    def __init__(self):
+        self._memory = TTLCache(IMAGE_MEMORY_SIZE, IMAGE_MEMORY_TTL)
+        self.index = HashIndex()
+        self._load_task: Optional[asyncio.Task] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stores = 0
+        cache.register("images", self)
+    
+    async def get(self, file_unique_id: str) -> Optional[Dict[str, Any]]:
+        """Cached answer for this exact photo, or None (no download needed)"""
+        if not IMAGE_CACHE_ENABLED:
+            return None
+        result = self._memory.get(file_unique_id)
+        if result is not None:
+            self.memory_hits += 1
+            db.touch_cached_image_answer(file_unique_id)
+            return dict(result)
+        
+        result = await self._load(file_unique_id)
+        if result is not None:
+            self.disk_hits += 1
+            self._memory.set(file_unique_id, result)
+            db.touch_cached_image_answer(file_unique_id)
+            return dict(result)
+        return None
+    
+    async def get_similar(self, file_unique_id: str, phash: Optional[int]) -> Optional[Dict[str, Any]]:
+        """
+        Cached answer for another copy of the same photo, or None (counted as
+        a miss: call after get() missed). A hit is remembered under this
+        file_unique_id, so further forwards of this copy hit get()
+        """
+        if not IMAGE_CACHE_ENABLED:
+            return None
+        match = self.index.nearest(phash, IMAGE_HASH_MAX_DISTANCE) if phash is not None else None
+        if match is not None:
+            similar_id, _ = match
+            result = self._memory.get(similar_id)
+            if result is None:
+                result = await self._load(similar_id)
+            if result is None:
+                # Pruned from the table since the index was loaded
+                self.index.remove(similar_id)
+            else:
+                self.near_hits += 1
+                self._memory.set(file_unique_id, result)
+                # No hash on the copy: the original stays the one the index finds
+                self._store(file_unique_id, None, result)
+                db.touch_cached_image_answer(similar_id)
+                return dict(result)
+        
+        self.misses += 1
+        return None
+    
+    async def _load(self, file_unique_id: str) -> Optional[Dict[str, Any]]:
+        payload = await db.get_cached_image_answer(file_unique_id)
+        if payload is None:
+            return None
+        try:
+            return json.loads(zlib.decompress(payload))
+        except (zlib.error, ValueError) as e:
+            print(f"⚠️ Unreadable cached photo answer {file_unique_id}: {e}")
+            return None
+    
+    def _store(self, file_unique_id: str, phash: Optional[int], result: Dict[str, Any]):
+        payload = zlib.compress(json.dumps(result, ensure_ascii=False).encode(), 6)
+        db.store_cached_image_answer(
+            file_unique_id,
+            phash.to_bytes(HASH_BITS // 8, "big") if phash is not None else None,
+            payload
+        )
+    
+    def put(self, file_unique_id: str, phash: Optional[int], result: Dict[str, Any]):
+        """Remember a successful answer to a photo"""
+        if not IMAGE_CACHE_ENABLED or not is_cacheable(result):
+            return
+        self._memory.set(file_unique_id, dict(result))
+        self._store(file_unique_id, phash, result)
+        self.stores += 1
+        if phash is not None:
+            self.index.add(file_unique_id, phash)
+    
+    async def load_index(self):
+        """Index the hashes in db.image_cache (photos cached meanwhile are added as they come)"""
+        rows = 0
+        async for file_unique_id, phash in db.iter_image_hashes():
+            self.index.add(file_unique_id, int.from_bytes(phash, "big"))
+            rows += 1
+            if rows % 1000 == 0:
+                await asyncio.sleep(0)
+        print(f"🖼️ Photo hash index ready: {len(self.index)} photos")
+    
+    async def _load_index_safely(self):
+        try:
+            await self.load_index()
+        except Exception as e:
+            print(f"❌ Photo hash index load failed: {e}")
+    
+    def start(self):
+        """Load the hash index in the background (after db.init_db)"""
+        if IMAGE_CACHE_ENABLED and self._load_task is None:
+            self._load_task = asyncio.create_task(self._load_index_safely())
+    
+    async def stop(self):
+        """Stop a hash index load still in progress"""
+        if self._load_task is not None:
+            self._load_task.cancel()
+            try:
+                await self._load_task
+            except asyncio.CancelledError:
+                pass
+            self._load_task = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Counters for /stats"""
+        hits = self.memory_hits + self.disk_hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            "size": db.image_cache_rows(),
+            "memory_size": len(self._memory),
+            "hashed": len(self.index),
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": (hits / lookups) if lookups else 0.0
+        }
+
+# Global photo answer cache instance
+image_cache = ImageAnswerCache()
@@ -0,0 +1,139 @@
+"""
+Image preparation for the website API
+Photos are hashed (for image_cache.py), downscaled and re-encoded in a
+process pool before upload, so a few large photos neither block the event
+loop nor eat upload bandwidth. Pillow is in requirements.txt; if it is
+missing anyway, images are uploaded as they are and only exact copies hit
+the cache.
+"""
+
+import io
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple, Union
+
+try:
+    from PIL import Image, ImageChops, ImageOps
+except ImportError:
+    Image = None
+
+# Longest side in pixels and the size re-encoding aims for
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))
+IMAGE_TARGET_BYTES = int(os.getenv("IMAGE_TARGET_BYTES", "200000"))
+# JPEG quality to start from, and the lowest it is lowered to for IMAGE_TARGET_BYTES
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+IMAGE_MIN_QUALITY = int(os.getenv("IMAGE_MIN_QUALITY", "50"))
+# Worker processes for hashing and re-encoding (0 = upload images unchanged, no hashing)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# dHash grid: HASH_SIZE x HASH_SIZE brightness comparisons = 256 bits
+HASH_SIZE = 16
+# Brightness difference from the border colour that counts as content when
+# trimming margins before hashing
+HASH_TRIM_THRESHOLD = 32
+
+# Photo bytes, or the path of a photo spooled to a file (spool.py)
+Photo = Union[bytes, str]
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def _pool_context():
+    """
+    forkserver (spawn where it is missing): forking the running bot would
+    copy locks held by aiosqlite and to_thread worker threads into the
+    workers, which can deadlock them. Workers re-import the main module, so
+    main.py must keep its __name__ == "__main__" guard
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # Workers need this module and Pillow, not the whole bot
+        context.set_forkserver_preload(["images"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+def photo_size(photo: Photo) -> int:
+    return len(photo) if isinstance(photo, bytes) else os.path.getsize(photo)
+
+def _dhash(image) -> int:
+    """
+    Difference hash: whether each pixel of a small grayscale copy is
+    brighter than its right neighbour. Plain margins are trimmed first, so
+    copies cropped differently around the same content hash alike.
+    """
+    gray = image.convert("L")
+    background = Image.new("L", gray.size, gray.getpixel((0, 0)))
+    content = ImageChops.difference(gray, background).point(lambda p: 255 if p > HASH_TRIM_THRESHOLD else 0)
+    box = content.getbbox()
+    if box:
+        gray = gray.crop(box)
+    small = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = value << 1 | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def _prepare(data: Photo, max_side: int, target_bytes: int, quality: int,
+             min_quality: int) -> Tuple[Optional[bytes], int]:
+    """
+    (re-encoded JPEG, perceptual hash) of a photo (runs in a worker process)
+    Photos over target_bytes are resized to max_side and re-encoded,
+    lowering the quality until the result fits; the JPEG is None when the
+    photo is small enough already or re-encoding did not make it smaller
+    """
+    # A spooled photo is read by the worker itself, not sent through the pipe
+    image = Image.open(io.BytesIO(data) if isinstance(data, bytes) else data)
+    image = ImageOps.exif_transpose(image)
+    phash = _dhash(image)
+    size = photo_size(data)
+    if size <= target_bytes:
+        return None, phash
+    
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    
+    while True:
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=quality, optimize=True)
+        if out.tell() <= target_bytes or quality - 10 < min_quality:
+            break
+        quality -= 10
+    
+    encoded = out.getvalue()
+    return (encoded if len(encoded) < size else None), phash
+
+async def prepare_photo(data: Photo) -> Tuple[Photo, Optional[int]]:
+    """
+    JPEG to upload for a photo (Telegram photos are JPEG already) and its
+    256-bit perceptual hash, None without Pillow or for unreadable images
+    Photos within IMAGE_TARGET_BYTES are sent unchanged
+    """
+    global _executor
+    if Image is None or IMAGE_WORKERS <= 0:
+        return data, None
+    
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=_pool_context())
+    try:
+        encoded, phash = await asyncio.get_running_loop().run_in_executor(
+            _executor, _prepare, data, IMAGE_MAX_SIDE, IMAGE_TARGET_BYTES,
+            IMAGE_JPEG_QUALITY, IMAGE_MIN_QUALITY
+        )
+    except Exception as e:
+        # Not an image Pillow can read; let the backend decide
+        print(f"⚠️ Could not process image: {e}")
+        return data, None
+    return (encoded if encoded is not None else data), phash
+
+def shutdown():
+    """Stop the worker processes"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -15,6 +15,11 @@ load_dotenv()
 
 # Import modules
 import db
+import backup
+import images
+from spool import spool
+from answer_cache import answer_cache
+from image_cache import image_cache
 from apiclient import api_client
 from handlers_chat import register_chat_handlers
 from handlers_group import register_group_handlers
@@ -41,11 +46,18 @@ async def main():
     # Initialize services
     print("🔧 Initializing database...")
     await db.init_db()
+    backup.start_scheduler()
+    answer_cache.start()
+    image_cache.start()
     print("✅ Database initialized")
     
     print("🔧 Initializing API client...")
     await api_client.init_session()
-    print("✅ API client initialized")
+    warm = await api_client.warm_up()
+    print(f"✅ API client initialized ({warm} warm connections)")
+    
+    # Nothing is downloading yet, so every spooled file is an orphan
+    spool.sweep()
     
     # Create Pyrogram client
     print("🤖 Creating Telegram Bot...")
@@ -91,6 +103,12 @@ async def main():
         print("\n👋 Stopping bot...")
     finally:
         await app.stop()
+        await api_client.close_session()
+        images.shutdown()
+        await backup.stop_scheduler()
+        await answer_cache.stop()
+        await image_cache.stop()
+        await db.close_db()
 
 if __name__ == "__main__":
     try:
@@ -1,10 +1,22 @@
 """
 Mock API module for testing when real website API is unavailable
 यह मॉड्यूल वास्तविक वेबसाइट API न होने पर टेस्टिंग के लिए उपयोग होता है
+
+Also runs as a local HTTP backend (POST /solve, streamed when the body
+has "stream": true or multipart for photos, and /solve/batch) so the API client can be load-tested
+offline:
+    python mock_api.py serve --port 8080
+    python mock_api.py bench --requests 2000 --concurrency 200
 """
 
+import os
+import sys
+import time
 import random
-from typing import Dict, Any
+import asyncio
+import argparse
+import json
+from typing import Dict, Any, List
 
 # Sample NEET/JEE questions and answers for mock responses
 MOCK_RESPONSES = [
@@ -82,12 +94,12 @@ async def get_mock_answer(question: str, uid: int, mode: str = "short") -> Dict[
         "uid": uid
     }
 
-async def get_mock_image_answer(file_path: str, uid: int) -> Dict[str, Any]:
+async def get_mock_image_answer(image, uid: int) -> Dict[str, Any]:
     """
     Mock response for image-based questions
     
     Args:
-        file_path: Path to image file
+        image: Photo bytes or spooled file path
         uid: User ID
     
     Returns:
@@ -102,3 +114,163 @@ async def get_mock_image_answer(file_path: str, uid: int) -> Dict[str, Any]:
         "mode": "short",
         "uid": uid
     }
+
+# ==================== LOCAL MOCK BACKEND ====================
+
+# Simulated backend: MOCK_SLOTS parallel workers; a request holds one for
+# MOCK_LATENCY seconds, a batch for MOCK_LATENCY + MOCK_BATCH_ITEM_COST per item
+MOCK_SLOTS = int(os.getenv("MOCK_SLOTS", "8"))
+MOCK_LATENCY = float(os.getenv("MOCK_LATENCY", "0.3"))
+MOCK_BATCH_ITEM_COST = float(os.getenv("MOCK_BATCH_ITEM_COST", "0.02"))
+# Share of batch items answered with an error (to exercise per-item fallback)
+MOCK_ITEM_FAILURE_RATE = float(os.getenv("MOCK_ITEM_FAILURE_RATE", "0"))
+# Part of MOCK_LATENCY a streamed answer takes before its first words
+MOCK_FIRST_CHUNK = float(os.getenv("MOCK_FIRST_CHUNK", "0.2"))
+
+def create_mock_app():
+    """aiohttp app serving the website API contract from the mock answers"""
+    from aiohttp import web
+    
+    slots = asyncio.Semaphore(MOCK_SLOTS)
+    
+    async def solve(request):
+        if request.content_type == "multipart/form-data":
+            return await solve_image(request)
+        body = await request.json()
+        if body.get("stream"):
+            return await solve_stream(request, body)
+        async with slots:
+            await asyncio.sleep(MOCK_LATENCY)
+        return web.json_response(await get_mock_answer(body.get("q", ""), body.get("uid", 0), body.get("mode", "short")))
+    
+    async def solve_image(request):
+        form = await request.post()
+        image = form["image"].file.read()
+        async with slots:
+            await asyncio.sleep(MOCK_LATENCY)
+        return web.json_response(await get_mock_image_answer(image, int(form.get("uid", 0))))
+    
+    async def solve_stream(request, body):
+        """Server-sent events: the answer word by word, then the full result"""
+        answer = await get_mock_answer(body.get("q", ""), body.get("uid", 0), body.get("mode", "short"))
+        words = answer["short_answer"].split(" ")
+        step = MOCK_LATENCY * (1 - MOCK_FIRST_CHUNK) / len(words)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        async with slots:
+            await asyncio.sleep(MOCK_LATENCY * MOCK_FIRST_CHUNK)
+            await response.prepare(request)
+            for i, word in enumerate(words):
+                delta = word if i == 0 else " " + word
+                await response.write(f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n".encode())
+                await asyncio.sleep(step)
+            await response.write(f"data: {json.dumps(answer, ensure_ascii=False)}\n\n".encode())
+        await response.write_eof()
+        return response
+    
+    async def solve_batch(request):
+        items = (await request.json()).get("items", [])
+        async with slots:
+            await asyncio.sleep(MOCK_LATENCY + MOCK_BATCH_ITEM_COST * len(items))
+        results = []
+        for item in items:
+            if random.random() < MOCK_ITEM_FAILURE_RATE:
+                results.append({"id": item.get("id"), "error": "mock item failure"})
+                continue
+            answer = await get_mock_answer(item.get("q", ""), item.get("uid", 0), item.get("mode", "short"))
+            answer["id"] = item.get("id")
+            results.append(answer)
+        return web.json_response({"results": results})
+    
+    async def options(request):
+        return web.Response()
+    
+    app = web.Application()
+    app.router.add_post("/solve", solve)
+    app.router.add_post("/solve/batch", solve_batch)
+    app.router.add_route("OPTIONS", "/solve", options)
+    return app
+
+async def _start_server(port: int):
+    from aiohttp import web
+    runner = web.AppRunner(create_mock_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+async def serve(port: int):
+    await _start_server(port)
+    print(f"🧪 Mock backend on http://127.0.0.1:{port}/solve (batch: /solve/batch)")
+    while True:
+        await asyncio.sleep(3600)
+
+async def bench(port: int, requests: int, concurrency: int):
+    """
+    Throughput of APIClient against the local mock: single requests,
+    batched, and streamed (with time to first content)
+    """
+    runner = await _start_server(port)
+    os.environ["WEBSITE_API_URL"] = f"http://127.0.0.1:{port}/solve"
+    import apiclient
+    
+    def percentiles(samples: List[float]) -> str:
+        samples = sorted(samples)
+        return (f"p50 {samples[len(samples) // 2] * 1000:.0f} ms, "
+                f"p99 {samples[int(len(samples) * 0.99)] * 1000:.0f} ms")
+    
+    try:
+        for run in ("single", "batched", "streamed"):
+            client = apiclient.APIClient()
+            client.batcher.enabled = run == "batched"
+            apiclient.API_STREAM_ENABLED = run == "streamed"
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies: List[float] = []
+            first_content: List[float] = []
+            
+            async def one(i: int) -> bool:
+                async with semaphore:
+                    started = time.perf_counter()
+                    shown = []
+                    
+                    def on_progress(text: str):
+                        if not shown:
+                            shown.append(text)
+                            first_content.append(time.perf_counter() - started)
+                    
+                    # _fetch_answer: measure the backend path, not the answer cache
+                    result = await client._fetch_answer(f"bench question {i}", i, "short",
+                                                        apiclient.Ticket(apiclient.PRIORITY_PRIVATE), on_progress)
+                    latencies.append(time.perf_counter() - started)
+                    return bool(result.get("success")) and not result.get("fallback")
+            
+            started = time.perf_counter()
+            ok = sum(await asyncio.gather(*(one(i) for i in range(requests))))
+            elapsed = time.perf_counter() - started
+            await client.close_session()
+            
+            line = f"{run:8}: {requests / elapsed:7.1f} req/s, {percentiles(latencies)}, {ok}/{requests} ok"
+            if run == "batched":
+                line += f", {client.stats()['batches']}"
+            if first_content:
+                line += f", first content {percentiles(first_content)}"
+            print(line)
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock backend for the website API")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="run the mock backend")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    bench_parser = sub.add_parser("bench", help="measure client throughput against the mock backend")
+    bench_parser.add_argument("--port", type=int, default=8089)
+    bench_parser.add_argument("--requests", type=int, default=2000)
+    bench_parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    
+    try:
+        if args.command == "serve":
+            asyncio.run(serve(args.port))
+        else:
+            asyncio.run(bench(args.port, args.requests, args.concurrency))
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,155 @@
+"""
+Retry policy, circuit breaker and latency tracking for calls to the website API
+Retries only failures worth retrying, with jittered exponential backoff,
+stops calling a backend that keeps failing until it recovers, and keeps
+the recent latency distribution that hedging and deadlines are based on.
+"""
+
+import os
+import time
+import random
+import asyncio
+import aiohttp
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+API_RETRY_ATTEMPTS = int(os.getenv("API_RETRY_ATTEMPTS", "3"))
+API_RETRY_BASE_DELAY = float(os.getenv("API_RETRY_BASE_DELAY", "0.5"))
+API_RETRY_MAX_DELAY = float(os.getenv("API_RETRY_MAX_DELAY", "4"))
+# No new attempt is started once this many seconds have passed
+API_RETRY_MAX_ELAPSED = float(os.getenv("API_RETRY_MAX_ELAPSED", "20"))
+
+# Consecutive failures that open the breaker, and seconds before a probe is let through
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Recent requests kept per mode, and how many are needed before percentiles are trusted
+API_LATENCY_WINDOW = int(os.getenv("API_LATENCY_WINDOW", "500"))
+API_LATENCY_MIN_SAMPLES = int(os.getenv("API_LATENCY_MIN_SAMPLES", "30"))
+
+class BackendError(Exception):
+    """Non-200 response from the website API"""
+    
+    def __init__(self, status: int):
+        super().__init__(f"API returned status {status}")
+        self.status = status
+
+class RetryPolicy:
+    """Which errors to retry and how long to wait before the next attempt"""
+    
+    def __init__(self, attempts: int = API_RETRY_ATTEMPTS, base_delay: float = API_RETRY_BASE_DELAY,
+                 max_delay: float = API_RETRY_MAX_DELAY, max_elapsed: float = API_RETRY_MAX_ELAPSED):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.retries = 0
+    
+    @staticmethod
+    def is_retryable(error: BaseException) -> bool:
+        """5xx, timeouts and connection failures; never 4xx"""
+        if isinstance(error, BackendError):
+            return error.status >= 500
+        return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, ConnectionError))
+    
+    def next_delay(self, error: BaseException, attempt: int, elapsed: float) -> Optional[float]:
+        """
+        Seconds to wait before retrying after failed attempt number `attempt`
+        (0-based), or None to give up
+        """
+        if not self.is_retryable(error) or attempt + 1 >= self.attempts:
+            return None
+        # Full jitter: a crowd of failed requests does not come back in lockstep
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if elapsed + delay >= self.max_elapsed:
+            return None
+        self.retries += 1
+        return delay
+
+class CircuitBreaker:
+    """
+    closed -> open after BREAKER_FAILURE_THRESHOLD consecutive failures;
+    open fails fast for BREAKER_RESET_TIMEOUT seconds, then half-open lets
+    one probe through: success closes the breaker, failure opens it again
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = False
+        self._probe_started = 0.0
+    
+    def allow(self) -> bool:
+        """Whether a request may go to the backend now"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        
+        if self.state == self.CLOSED:
+            return True
+        # A probe that never reported back (e.g. cancelled) does not block forever
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN and (not self._probing or now - self._probe_started >= self.reset_timeout):
+            self._probing = True
+            self._probe_started = now
+            return True
+        self.rejected += 1
+        return False
+    
+    def record_success(self):
+        if self.state != self.CLOSED:
+            print(f"✅ Circuit {self.name} closed, backend is healthy again")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            self._probing = False
+            print(f"⚡ Circuit {self.name} open after {self.failures} failures, using fallback for {self.reset_timeout:.0f}s")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected
+        }
+
+class LatencyTracker:
+    """Rolling window of recent request latencies (seconds)"""
+    
+    def __init__(self, window: int = API_LATENCY_WINDOW, min_samples: int = API_LATENCY_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._sorted: Optional[List[float]] = None
+    
+    def __len__(self) -> int:
+        return len(self._samples)
+    
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+        self._sorted = None
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """q-th quantile (0..1) of the window, or None until there are enough samples"""
+        if len(self._samples) < self.min_samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
@@ -0,0 +1,530 @@
+"""
+Near-duplicate question index for the answer cache
+Students rephrase ("plz answer", emojis, small typos), so exact cache keys
+miss many repeats. Questions are cut into character n-gram shingles and
+sketched with one-permutation MinHash; LSH bands find candidates and the
+sketches estimate Jaccard similarity. Questions that differ in their
+numbers or in words that flip what is asked (min/max, increase/decrease,
+not, true/false) never match. Off by default (SIMILARITY_ENABLED=1 turns it
+on). The index is saved to SIMILARITY_INDEX_PATH and loaded at startup.
+
+Offline benchmark:
+    python similarity.py --size 1000000
+"""
+
+import os
+import re
+import sys
+import time
+import zlib
+import struct
+import random
+import argparse
+import operator
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from typing import Dict, List, Optional, Tuple
+
+SIMILARITY_ENABLED = os.getenv("SIMILARITY_ENABLED", "0") == "1"
+# Minimum estimated Jaccard similarity for reusing an answer
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.85"))
+SIMILARITY_INDEX_PATH = os.getenv("SIMILARITY_INDEX_PATH", "similarity.idx")
+SIMILARITY_SAVE_INTERVAL = float(os.getenv("SIMILARITY_SAVE_INTERVAL", "900"))
+# Shorter questions (after fillers are removed) are only matched exactly
+SIMILARITY_MIN_LENGTH = int(os.getenv("SIMILARITY_MIN_LENGTH", "12"))
+# Inserts wait in a small dict and are merged into the sorted band tables in
+# batches (in a worker thread, see answer_cache.py)
+SIMILARITY_DELTA_MAX = int(os.getenv("SIMILARITY_DELTA_MAX", "5000"))
+
+SHINGLE_SIZE = 4
+NUM_BINS = 64
+BANDS = 16
+ROWS = NUM_BINS // BANDS
+MAX_BUCKET = 256
+MAX_CANDIDATES = 64
+# A question above the threshold shares about half of the bands; one shared
+# band is usually just common wording ("what is the ... of")
+MIN_VOTES = 2
+KEY_BYTES = 20  # sha1 digest of the answer cache key
+
+FORMAT_MAGIC = b"NQSI"
+FORMAT_VERSION = 2
+# magic, version, bins, bands, shingle size, entries, saved_at
+_HEADER = struct.Struct("<4sIIIIId")
+
+_MASK64 = (1 << 64) - 1
+_VALUE_BITS = 58
+_VALUE_MASK = (1 << _VALUE_BITS) - 1
+_EMPTY = 1 << 64
+_GOLDEN = 0x9E3779B97F4A7C15
+_BAND_FORMAT = struct.Struct(f"<{ROWS}Q")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+_WORD_EDGES = ":-/()[]{}=+*<>"
+
+# Words that do not change the question (English, Hinglish, Hindi)
+FILLER_WORDS = frozenset("""
+plz pls please plzz plss answer ans solve solution sir mam maam madam bhai bro
+help urgent fast quickly jaldi batao btao bataiye bataye bta koi
+कृपया प्लीज़ प्लीज उत्तर जवाब बताओ बताइए बताइये बताएं भाई सर जल्दी
+""".split())
+
+def strip_fillers(normalized: str) -> str:
+    """Drop filler words from an already normalized question"""
+    return " ".join(word for word in normalized.split() if word not in FILLER_WORDS)
+
+# Words that flip what a question asks for; negations all count as "not",
+# so "isn't" still matches "is not"
+NEGATION_WORDS = frozenset("""
+not no never nor cannot cant dont doesnt didnt isnt arent wasnt werent wont
+wouldnt shouldnt couldnt hasnt havent hadnt nahi nahin nhi नहीं नही न मत
+""".split())
+POLARITY_WORDS = frozenset("""
+none without except true false correct incorrect right wrong max min most least
+more less lesser above below before after positive negative gain loss attract
+repel sahi galat jyada zyada kam सही गलत ग़लत सत्य असत्य अधिक कम ज्यादा ज़्यादा
+""".split())
+# Prefixes standing for all their inflections (increase, increases, increasing)
+POLARITY_STEMS = (
+    "increas", "decreas", "maxim", "minim", "high", "low", "larg", "small",
+    "great", "exotherm", "endotherm", "oxidi", "reduc", "बढ़", "घट", "अधिकतम", "न्यूनतम"
+)
+
+def polarity_terms(normalized: str) -> List[str]:
+    """Polarity words of a question in order (normalization splits "n't" into "n t")"""
+    terms = []
+    previous = ""
+    for word in normalized.split():
+        # Normalization keeps ':', '-', brackets etc. that may stick to a word
+        word = word.strip(_WORD_EDGES)
+        if word in NEGATION_WORDS or (word == "t" and previous.endswith("n")):
+            terms.append("not")
+        elif word in POLARITY_WORDS:
+            terms.append(word)
+        else:
+            stem = next((stem for stem in POLARITY_STEMS if word.startswith(stem)), None)
+            if stem is not None:
+                terms.append(stem)
+        previous = word
+    return terms
+
+def terms_key(normalized: str) -> int:
+    """
+    Checksum of a question's numbers and polarity words, in order: "5 kg"
+    never matches "6 kg", "minimum" never matches "maximum" and "A is true,
+    B is false" never matches "A is false, B is true"
+    """
+    numbers = " ".join(_NUMBER_RE.findall(normalized))
+    return zlib.crc32(f"{numbers}|{' '.join(polarity_terms(normalized))}".encode())
+
+def sketch(text: str) -> List[int]:
+    """
+    One-permutation MinHash of the text's shingles (NUM_BINS values)
+    Each shingle is hashed once; the top bits pick a bin, the rest compete
+    for that bin's minimum. Empty bins borrow from the next filled bin.
+    """
+    mins = [_EMPTY] * NUM_BINS
+    for i in range(max(1, len(text) - SHINGLE_SIZE + 1)):
+        data = text[i:i + SHINGLE_SIZE].encode()
+        h = ((zlib.crc32(data) | zlib.crc32(data, 0x9747B28C) << 32) * _GOLDEN) & _MASK64
+        b = h >> _VALUE_BITS
+        value = h & _VALUE_MASK
+        if value < mins[b]:
+            mins[b] = value
+    
+    filled = [b for b in range(NUM_BINS) if mins[b] != _EMPTY]
+    if len(filled) < NUM_BINS:
+        original = list(mins)
+        for b in range(NUM_BINS):
+            if original[b] == _EMPTY:
+                for distance in range(1, NUM_BINS):
+                    source = original[(b + distance) % NUM_BINS]
+                    if source != _EMPTY:
+                        mins[b] = (source + distance * _GOLDEN) & _MASK64
+                        break
+    return mins
+
+def estimate_similarity(a: bytes, b: bytes) -> float:
+    """Jaccard estimate from two 8-bit sketches (corrected for chance collisions)"""
+    same = bytes(map(operator.xor, a, b)).count(0)
+    return max(0.0, (same / NUM_BINS - 1 / 256) / (1 - 1 / 256))
+
+class SimilarityIndex:
+    """
+    MinHash/LSH index of answered questions
+    Per entry: answer cache key, 8-bit sketch and a terms_key checksum.
+    Per band: a sorted array of (band hash << 32 | entry), plus a dict of
+    recent inserts that have not been merged yet. A live index is merged with
+    begin_merge/merged_tables/finish_merge so the sorting can run in a
+    worker thread while add() and query() go on.
+    """
+    
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.saved_at = 0.0
+        self._keys = bytearray()
+        self._sigs = bytearray()
+        self._terms = array("I")
+        self._bands = [array("Q") for _ in range(BANDS)]
+        self._pending = [array("Q") for _ in range(BANDS)]
+        self._delta: List[Dict[int, List[int]]] = [{} for _ in range(BANDS)]
+        # Inserts being merged (between begin_merge and finish_merge)
+        self._frozen: Optional[List[array]] = None
+        self._merging: Optional[List[Dict[int, List[int]]]] = None
+        self.lookups = 0
+        self.matches = 0
+    
+    def __len__(self) -> int:
+        return len(self._terms)
+    
+    @staticmethod
+    def _band_hashes(mode: str, mins: List[int]) -> List[int]:
+        seed = zlib.crc32(mode.encode())
+        return [
+            zlib.crc32(_BAND_FORMAT.pack(*mins[band * ROWS:(band + 1) * ROWS]), seed ^ band)
+            for band in range(BANDS)
+        ]
+    
+    def add(self, normalized: str, mode: str, key: str, bulk: bool = False) -> bool:
+        """
+        Index an answered question (normalized as in answer_cache)
+        bulk=True skips the lookup dict; call merge() when done
+        """
+        text = strip_fillers(normalized)
+        if len(text) < SIMILARITY_MIN_LENGTH:
+            return False
+        
+        mins = sketch(text)
+        entry = len(self._terms)
+        self._keys += bytes.fromhex(key)
+        self._sigs += bytes(value & 0xFF for value in mins)
+        self._terms.append(terms_key(normalized))
+        for band, band_hash in enumerate(self._band_hashes(mode, mins)):
+            self._pending[band].append(band_hash << 32 | entry)
+            if not bulk:
+                self._delta[band].setdefault(band_hash, []).append(entry)
+        return True
+    
+    def add_many(self, rows: List[Tuple[str, str, str]]) -> int:
+        """Bulk add (normalized, mode, key) rows; returns how many were indexed"""
+        return sum(self.add(normalized, mode, key, bulk=True) for normalized, mode, key in rows)
+    
+    def pending(self) -> int:
+        """Inserts not merged into the band tables yet"""
+        return len(self._pending[0])
+    
+    def merge_due(self) -> bool:
+        """Enough inserts are waiting and no merge is running"""
+        return self._frozen is None and self.pending() >= SIMILARITY_DELTA_MAX
+    
+    def begin_merge(self):
+        """Set the pending inserts aside for merged_tables(); lookups still find them"""
+        if self._frozen is not None:
+            raise RuntimeError("a merge is already running")
+        self._frozen, self._pending = self._pending, [array("Q") for _ in range(BANDS)]
+        self._merging, self._delta = self._delta, [{} for _ in range(BANDS)]
+    
+    @staticmethod
+    def _merge_sorted(table: array, inserts: array) -> array:
+        """
+        Sorted table plus a few inserts: the inserts are sorted and the
+        table is copied between their positions in slices, so the cost is
+        a memcpy of the table rather than a full re-sort
+        """
+        merged = array("Q")
+        start = 0
+        for value in sorted(inserts):
+            position = bisect_left(table, value, start)
+            merged.extend(table[start:position])
+            merged.append(value)
+            start = position
+        merged.extend(table[start:])
+        return merged
+    
+    def merged_tables(self) -> List[array]:
+        """
+        Band tables with the set-aside inserts folded in (safe in a worker
+        thread: add() and query() do not touch either input meanwhile)
+        """
+        return [
+            self._merge_sorted(table, frozen) if frozen else table
+            for table, frozen in zip(self._bands, self._frozen)
+        ]
+    
+    def finish_merge(self, tables: List[array]):
+        """Swap in the tables from merged_tables()"""
+        self._bands = tables
+        self._frozen = self._merging = None
+    
+    def abort_merge(self):
+        """Put the set-aside inserts back after a merge was abandoned"""
+        if self._frozen is None:
+            return
+        self._pending = [array("Q", chain(frozen, pending)) for frozen, pending in zip(self._frozen, self._pending)]
+        for merging, delta in zip(self._merging, self._delta):
+            for band_hash, entries in merging.items():
+                delta.setdefault(band_hash, []).extend(entries)
+        self._frozen = self._merging = None
+    
+    def merge(self):
+        """Fold pending inserts into the band tables right here (bulk builds)"""
+        self.begin_merge()
+        self.finish_merge(self.merged_tables())
+    
+    def _bucket(self, band: int, band_hash: int) -> List[int]:
+        table = self._bands[band]
+        i = bisect_left(table, band_hash << 32)
+        entries = []
+        while i < len(table) and table[i] >> 32 == band_hash and len(entries) < MAX_BUCKET:
+            entries.append(table[i] & 0xFFFFFFFF)
+            i += 1
+        entries.extend(self._delta[band].get(band_hash, ()))
+        if self._merging is not None:
+            entries.extend(self._merging[band].get(band_hash, ()))
+        return entries
+    
+    def query(self, normalized: str, mode: str) -> Optional[Tuple[str, float]]:
+        """(answer cache key, similarity) of the closest question above the threshold"""
+        self.lookups += 1
+        text = strip_fillers(normalized)
+        if len(text) < SIMILARITY_MIN_LENGTH or not self._terms:
+            return None
+        
+        mins = sketch(text)
+        sig = bytes(value & 0xFF for value in mins)
+        terms = terms_key(normalized)
+        
+        votes = Counter()
+        for band, band_hash in enumerate(self._band_hashes(mode, mins)):
+            votes.update(self._bucket(band, band_hash))
+        
+        best_entry, best_score = -1, 0.0
+        for entry, count in votes.most_common(MAX_CANDIDATES):
+            if count < MIN_VOTES:
+                break
+            if self._terms[entry] != terms:
+                continue
+            offset = entry * NUM_BINS
+            score = estimate_similarity(sig, self._sigs[offset:offset + NUM_BINS])
+            if score > best_score:
+                best_entry, best_score = entry, score
+        
+        if best_entry < 0 or best_score < self.threshold:
+            return None
+        self.matches += 1
+        offset = best_entry * KEY_BYTES
+        return self._keys[offset:offset + KEY_BYTES].hex(), best_score
+    
+    def snapshot(self) -> List[bytes]:
+        """
+        Serialize (call on the event loop after merging; write the parts
+        anywhere). Anything still pending is merged here first
+        """
+        if self._frozen is not None:
+            raise RuntimeError("a merge is still running")
+        if self.pending():
+            self.merge()
+        self.saved_at = time.time()
+        header = _HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, NUM_BINS, BANDS, SHINGLE_SIZE,
+                              len(self), self.saved_at)
+        return [header, bytes(self._keys), bytes(self._sigs), self._terms.tobytes()] + [
+            table.tobytes() for table in self._bands
+        ]
+    
+    @classmethod
+    def load(cls, path: str = SIMILARITY_INDEX_PATH) -> Optional["SimilarityIndex"]:
+        """Read a saved index; None if missing, damaged or built with other parameters"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return None
+                magic, version, bins, bands, shingle, count, saved_at = _HEADER.unpack(header)
+                if (magic, version, bins, bands, shingle) != (FORMAT_MAGIC, FORMAT_VERSION, NUM_BINS, BANDS, SHINGLE_SIZE):
+                    return None
+                
+                index = cls()
+                index.saved_at = saved_at
+                index._keys = bytearray(f.read(count * KEY_BYTES))
+                index._sigs = bytearray(f.read(count * NUM_BINS))
+                index._terms.frombytes(f.read(count * index._terms.itemsize))
+                for table in index._bands:
+                    table.frombytes(f.read(count * table.itemsize))
+                    if len(table) != count:
+                        return None
+        except (OSError, ValueError, struct.error) as e:
+            print(f"⚠️ Could not load similarity index {path}: {e}")
+            return None
+        
+        if len(index._keys) != count * KEY_BYTES or len(index._sigs) != count * NUM_BINS:
+            return None
+        return index
+    
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self), "lookups": self.lookups, "matches": self.matches}
+
+def write_snapshot(parts: List[bytes], path: str = SIMILARITY_INDEX_PATH):
+    """Write snapshot() parts atomically (fine to run in a worker thread)"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for part in parts:
+            f.write(part)
+    os.replace(tmp_path, path)
+
+# ==================== OFFLINE BENCHMARK ====================
+
+_SYLLABLES = ("ka ra ta na ma la sa pa da ga ha ba va ja cha tha pra tri sul fo "
+              "ox hy dro chlo nit ion ene ate ide ose ase lic tic gen cyte phyll").split()
+_TEMPLATES = (
+    "what is the {w} of {w} {w} in {w}",
+    "a body of mass {n} kg moves with {n} m/s find the {w} of {w}",
+    "define {w} and {w} with reference to {w} {w}",
+    "why does {w} {w} increase when {w} is {w}",
+    "{w} के {w} का {w} क्या है {w} में",
+    "calculate the {w} {w} if {w} is {n} and {w} is {n}",
+    "explain the role of {w} in {w} {w} {w}",
+    "find the maximum value of {w} {w} for {w} in {w}",
+    "does {w} {w} decrease when {w} {w} is increased",
+    "which is correct {w} {w} is true and {w} {w} is false",
+    "{w} is not a {w} of {w} {w} explain",
+)
+# Swaps that keep the wording but ask the opposite
+_ANTONYMS = {
+    "maximum": "minimum", "minimum": "maximum", "increase": "decrease", "decrease": "increase",
+    "increased": "decreased", "decreased": "increased", "true": "false", "false": "true",
+    "correct": "incorrect", "incorrect": "correct",
+}
+_FILLERS = ("plz answer", "sir please", "jaldi batao", "🙏", "???", "!!", "bhai solve")
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+def _question(rng: random.Random) -> str:
+    template = rng.choice(_TEMPLATES)
+    while "{w}" in template or "{n}" in template:
+        template = template.replace("{w}", _word(rng), 1).replace("{n}", str(rng.randint(1, 500)), 1)
+    return template
+
+def _rephrase(rng: random.Random, question: str) -> str:
+    """The kinds of edits students make to a question someone already asked"""
+    edit = rng.randrange(4)
+    if edit == 0:
+        return f"{question} {rng.choice(_FILLERS)}"
+    if edit == 1:
+        return f"{rng.choice(_FILLERS)} {question.upper()}"
+    if edit == 2:
+        i = rng.randrange(len(question))
+        return question[:i] + question[i + 1:]
+    return question.replace(" ", "  ") + " ??"
+
+def _distractor(rng: random.Random, question: str) -> str:
+    """A related but different question that must not match"""
+    if any(ch.isdigit() for ch in question):
+        return re.sub(r"\d+", lambda m: str(int(m.group()) + rng.randint(1, 9)), question, count=1)
+    words = question.split()
+    content = [i for i, word in enumerate(words) if len(word) > 3]
+    for i in rng.sample(content, min(2, len(content))):
+        words[i] = _word(rng)
+    return " ".join(words)
+
+def _minimal_edit(rng: random.Random, question: str) -> str:
+    """
+    The same question asking the opposite: one antonym swapped, two
+    polarity words trading places, or a "not" inserted
+    """
+    words = question.split()
+    polar = [i for i, word in enumerate(words) if word in _ANTONYMS]
+    edit = rng.randrange(3)
+    if edit == 0 and polar:
+        i = rng.choice(polar)
+        words[i] = _ANTONYMS[words[i]]
+    elif edit == 1 and len(polar) >= 2 and words[polar[0]] != words[polar[1]]:
+        words[polar[0]], words[polar[1]] = words[polar[1]], words[polar[0]]
+    else:
+        words.insert(rng.randrange(1, len(words)), "not")
+    return " ".join(words)
+
+def benchmark(size: int, queries: int, threshold: float, seed: int = 7):
+    """Build an index of `size` questions and measure precision, recall and latency"""
+    from answer_cache import cache_key
+    
+    rng = random.Random(seed)
+    index = SimilarityIndex(threshold)
+    stored = []
+    
+    started = time.perf_counter()
+    for i in range(size):
+        question = _question(rng)
+        key, normalized = cache_key(question, "short")
+        index.add(normalized, "short", key, bulk=True)
+        if len(stored) < queries:
+            stored.append((question, key))
+        if (i + 1) % 100000 == 0:
+            print(f"  indexed {i + 1}/{size}", file=sys.stderr)
+    index.merge()
+    build_time = time.perf_counter() - started
+    
+    parts = index.snapshot()
+    path = f"similarity-bench-{os.getpid()}.idx"
+    try:
+        write_snapshot(parts, path)
+        file_size = os.path.getsize(path)
+        started = time.perf_counter()
+        loaded = SimilarityIndex.load(path)
+        load_time = time.perf_counter() - started
+        assert loaded is not None and len(loaded) == len(index)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    
+    latencies = []
+    true_positive = false_positive = false_negative = 0
+    minimal_matches = 0
+    
+    def timed_query(question: str) -> Optional[str]:
+        _, normalized = cache_key(question, "short")
+        started = time.perf_counter()
+        match = loaded.query(normalized, "short")
+        latencies.append(time.perf_counter() - started)
+        return match[0] if match else None
+    
+    for question, key in stored:
+        # Rephrasings should find their original...
+        match = timed_query(_rephrase(rng, question))
+        if match == key:
+            true_positive += 1
+        else:
+            false_negative += 1
+            if match is not None:
+                false_positive += 1
+        # ...related questions and new questions should find nothing
+        for other in (_distractor(rng, question), _question(rng)):
+            if timed_query(other) is not None:
+                false_positive += 1
+        # ...and neither should the same wording asking the opposite
+        if timed_query(_minimal_edit(rng, question)) is not None:
+            false_positive += 1
+            minimal_matches += 1
+    
+    latencies.sort()
+    returned = true_positive + false_positive
+    print(f"entries:        {len(index)} (of {size})")
+    print(f"build:          {build_time:.1f}s ({build_time / size * 1e6:.0f} µs/question)")
+    print(f"file:           {file_size / 1e6:.1f} MB, load {load_time * 1000:.0f} ms")
+    print(f"threshold:      {threshold}")
+    print(f"precision:      {true_positive / returned if returned else 1.0:.4f}")
+    print(f"recall:         {true_positive / len(stored) if stored else 0.0:.4f}")
+    print(f"opposite match: {minimal_matches}/{len(stored)} minimal edits (must be 0)")
+    print(f"lookup p50:     {latencies[len(latencies) // 2] * 1e6:.0f} µs")
+    print(f"lookup p99:     {latencies[int(len(latencies) * 0.99)] * 1e6:.0f} µs")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Near-duplicate index benchmark")
+    parser.add_argument("--size", type=int, default=1000000, help="questions to index")
+    parser.add_argument("--queries", type=int, default=2000, help="stored questions to query (x4 lookups)")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    args = parser.parse_args()
+    benchmark(args.size, args.queries, args.threshold)
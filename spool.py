@@ -0,0 +1,215 @@
+"""
+Download spool for photo questions
+Photos up to SPOOL_MEMORY_MAX bytes are downloaded into memory; bigger ones
+go to a file in SPOOL_DIR (tmpfs when the system has one) that is streamed
+to the website API and deleted as soon as the answer is in. Every photo
+held, in memory or spooled, counts against SPOOL_QUOTA_MB until its last
+holder lets go; at most DOWNLOAD_CONCURRENCY downloads run at once.
+Spooled files carry SPOOL_PREFIX, and only those (plus Pyrogram's photo_*
+files in the legacy downloads/ directory) are ever deleted, so SPOOL_DIR
+may be shared with other files.
+"""
+
+import os
+import re
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Union
+from pyrogram.types import Message
+
+def _default_spool_dir() -> str:
+    """A directory on /dev/shm (tmpfs) when it is usable, else ./downloads"""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm/aimaibot-spool"
+    return "downloads"
+
+SPOOL_DIR = os.path.abspath(os.getenv("SPOOL_DIR") or _default_spool_dir())
+# Bytes of photos held at once, in memory and in SPOOL_DIR together
+SPOOL_QUOTA = int(float(os.getenv("SPOOL_QUOTA_MB", "256")) * 1024 * 1024)
+# Photos up to this size (bytes) are kept in memory instead of the spool
+SPOOL_MEMORY_MAX = int(os.getenv("SPOOL_MEMORY_MAX", str(2 * 1024 * 1024)))
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))
+# Name prefix of spooled files; nothing else in SPOOL_DIR is touched
+SPOOL_PREFIX = "aimaibot-spool-"
+# Where Pyrogram's message.download() used to put every photo, and the names it gave them
+LEGACY_DOWNLOAD_DIR = "downloads"
+LEGACY_PHOTO_NAME = re.compile(r"photo_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_\d+\.jpg(\.temp)?")
+
+class Spool:
+    """Download slots plus the quota on photos held in memory and in the spool directory"""
+    
+    def __init__(self, directory: str = SPOOL_DIR, quota: int = SPOOL_QUOTA):
+        self.directory = directory
+        self.quota = quota
+        self._slots = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+        self._names = itertools.count()
+        # key (the spooled file's path, or "memory-N") -> bytes reserved
+        self._in_use: Dict[str, int] = {}
+        # key -> holders (the download, plus shared requests that retain it)
+        self._holders: Dict[str, int] = {}
+        # id() of photo bytes in use -> key, and back
+        self._memory_keys: Dict[int, str] = {}
+        self._memory_ids: Dict[str, int] = {}
+        # Spooled files that could not be deleted -> bytes, still on disk (oldest first)
+        self._stale: Dict[str, int] = {}
+        self._released = asyncio.Condition()
+        self.downloads = 0
+        self.spooled = 0
+        self.evicted = 0
+        self.quota_waits = 0
+    
+    def _usage(self) -> int:
+        """Bytes held: reservations in use plus spooled files that could not be deleted"""
+        return sum(self._in_use.values()) + sum(self._stale.values())
+    
+    def _remove(self, path: str) -> bool:
+        """Delete a spooled file and Pyrogram's partial path + ".temp"; False if one is left"""
+        removed = True
+        for leftover in (path, path + ".temp"):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"⚠️ Could not remove spooled download {leftover}: {e}")
+                removed = False
+        return removed
+    
+    def _evict(self, needed: int) -> int:
+        """
+        Retry deleting stale files, oldest first, until `needed` more bytes
+        fit the quota; returns the bytes still missing
+        """
+        excess = self._usage() + needed - self.quota
+        for path in list(self._stale):
+            if excess <= 0:
+                break
+            if self._remove(path):
+                excess -= self._stale.pop(path)
+                self.evicted += 1
+        return max(0, excess)
+    
+    async def _reserve(self, key: str, size: int):
+        """Wait until `size` bytes fit the quota, then reserve them for key"""
+        async with self._released:
+            if self._evict(size) > 0:
+                self.quota_waits += 1
+                # A photo bigger than the whole quota only has to wait for an empty spool
+                await self._released.wait_for(
+                    lambda: self._usage() + size <= self.quota or not self._in_use
+                )
+            self._in_use[key] = size
+            self._holders[key] = 1
+    
+    def _key(self, photo: Union[bytes, str]) -> Optional[str]:
+        return photo if isinstance(photo, str) else self._memory_keys.get(id(photo))
+    
+    def retain(self, photo: Union[bytes, str]):
+        """
+        Keep a photo from download() counted (and a spooled file on disk)
+        after its download block exits, until release() (for requests
+        shared with other callers)
+        """
+        key = self._key(photo)
+        if key in self._holders:
+            self._holders[key] += 1
+    
+    async def release(self, photo: Union[bytes, str]):
+        """Let go of a retained photo; the last holder frees its quota and file"""
+        await self._release(self._key(photo))
+    
+    async def _release(self, key: Optional[str]):
+        if key not in self._holders:
+            return
+        self._holders[key] -= 1
+        if self._holders[key] > 0:
+            return
+        del self._holders[key]
+        if key.startswith("memory-"):
+            ident = self._memory_ids.pop(key, None)
+            self._memory_keys.pop(ident, None)
+        elif not self._remove(key):
+            # Still on disk: keep counting it until _evict manages to delete it
+            self._stale[key] = self._in_use.get(key, 0)
+        async with self._released:
+            self._in_use.pop(key, None)
+            self._released.notify_all()
+    
+    @asynccontextmanager
+    async def download(self, message: Message) -> AsyncIterator[Union[bytes, str]]:
+        """
+        Download a message's photo: yields its bytes, or the path of the
+        spooled file, which is deleted when the block exits (or when the
+        last retain() is released)
+        """
+        size = message.photo.file_size or 0
+        in_memory = size <= SPOOL_MEMORY_MAX
+        if in_memory:
+            key = f"memory-{next(self._names)}"
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            key = os.path.join(self.directory, f"{SPOOL_PREFIX}{message.photo.file_unique_id}-{next(self._names)}.jpg")
+        # Quota first: waiting for space does not hold a download slot
+        await self._reserve(key, size)
+        try:
+            async with self._slots:
+                self.downloads += 1
+                if in_memory:
+                    photo = (await message.download(in_memory=True)).getvalue()
+                    self._memory_keys[id(photo)] = key
+                    self._memory_ids[key] = id(photo)
+                else:
+                    if await message.download(file_name=key) is None:
+                        raise RuntimeError("photo download failed")
+                    photo = key
+                    self.spooled += 1
+            yield photo
+        finally:
+            await self._release(key)
+    
+    def sweep(self) -> int:
+        """
+        Delete spooled files left by earlier runs, and photos Pyrogram saved
+        to the legacy downloads directory (call at startup, before any
+        download). Returns files removed
+        """
+        legacy = os.path.abspath(LEGACY_DOWNLOAD_DIR)
+        removed = 0
+        for directory in {self.directory, legacy}:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                spooled = directory == self.directory and entry.name.startswith(SPOOL_PREFIX)
+                legacy_photo = directory == legacy and LEGACY_PHOTO_NAME.fullmatch(entry.name)
+                if not (spooled or legacy_photo) or not entry.is_file():
+                    continue
+                size = 0
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    print(f"⚠️ Could not remove leftover download {entry.path}: {e}")
+                    if spooled:
+                        self._stale[entry.path] = size
+        if removed:
+            print(f"🧹 Removed {removed} leftover downloads")
+        return removed
+    
+    def stats(self) -> Dict[str, int]:
+        """Counters for /stats"""
+        return {
+            "downloads": self.downloads,
+            "spooled": self.spooled,
+            "in_use": len(self._in_use),
+            "used_kb": self._usage() // 1024,
+            "in_memory": len(self._memory_keys),
+            "evicted": self.evicted,
+            "quota_waits": self.quota_waits
+        }
+
+# Global download spool
+spool = Spool()
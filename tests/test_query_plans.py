@@ -0,0 +1,20 @@
+"""
+Every query in db.PLANNED_QUERIES must be served by an index on a freshly
+migrated database, so a full table scan cannot quietly come back.
+"""
+
+import asyncio
+import db
+
+def test_no_full_table_scans(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "bot_data.db"))
+    monkeypatch.setattr(db, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    
+    async def check():
+        await db.init_db()
+        try:
+            return await db.check_query_plans()
+        finally:
+            await db.close_db()
+    
+    assert asyncio.run(check()) == []
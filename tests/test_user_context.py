@@ -0,0 +1,28 @@
+"""
+load_user_context must work when the profile cache keeps nothing
+(USER_CACHE_SIZE=0), reading language and pending prompt from the database.
+"""
+
+import asyncio
+import db
+from cache import TTLCache
+
+def test_user_context_without_profile_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "bot_data.db"))
+    monkeypatch.setattr(db, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(db, "_user_cache", TTLCache(0, 60, name="user_profiles"))
+    
+    async def check():
+        await db.init_db()
+        try:
+            first = await db.load_user_context(1, "user", "First", None)
+            await db.set_user_language(1, "english")
+            await db.save_pending_message(1, 10, -100)
+            second = await db.load_user_context(1, "user", "First", None)
+            return first, second
+        finally:
+            await db.close_db()
+    
+    first, second = asyncio.run(check())
+    assert first == {"language": "hindi", "pending": None}
+    assert second == {"language": "english", "pending": {"uid": 1, "message_id": 10, "chat_id": -100}}
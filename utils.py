@@ -4,7 +4,8 @@ Formatters, buttons, rate-limit helpers
 """
 
 import asyncio
-from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
+from pyrogram.errors import FloodWait
 from datetime import datetime
 import os
 
@@ -15,6 +16,14 @@ UPDATES_CHANNEL = "aimaibotupdates"
 # Global bot username - set by main.py after bot starts
 _bot_username = None
 
+# Process start time for /stats uptime
+BOT_START_TIME = datetime.now()
+
+# Minimum seconds between progressive edits of a streamed answer (Telegram
+# allows roughly one edit a second per chat, and 20 messages a minute in groups)
+ANSWER_EDIT_INTERVAL = float(os.getenv("ANSWER_EDIT_INTERVAL", "1.0"))
+ANSWER_EDIT_INTERVAL_GROUP = float(os.getenv("ANSWER_EDIT_INTERVAL_GROUP", "3.0"))
+
 def set_bot_username(username: str):
     """Set bot username globally for use in buttons"""
     global _bot_username
@@ -179,6 +188,72 @@ def format_answer_message(question: str, answer: str, lang="hindi"):
 
 — NEET AI Bot ✨"""
 
+class LiveAnswer:
+    """
+    Shows a streamed answer in the processing message while it arrives
+    The first chunk is shown at once, later ones at most every `interval`
+    seconds. Use as `async with` around api_client.get_answer(on_progress=
+    live.update); the handler then edits the same message with the final
+    answer and button.
+    """
+    
+    CURSOR = " ▌"
+    
+    def __init__(self, message: Message, question: str, lang="hindi", interval: float = ANSWER_EDIT_INTERVAL):
+        self.message = message
+        self.question = question
+        self.lang = lang
+        self.interval = interval
+        self._text = ""
+        self._shown = ""
+        self._changed = asyncio.Event()
+        self._task = None
+        self.edits = 0
+    
+    def update(self, text: str):
+        """Latest partial answer (on_progress callback)"""
+        self._text = text
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._edit_loop())
+    
+    async def _edit_loop(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            text = self._text
+            if text == self._shown:
+                continue
+            try:
+                await self.message.edit_text(format_answer_message(self.question, text + self.CURSOR, self.lang))
+                self.edits += 1
+            except FloodWait as e:
+                # Skip partial updates until Telegram lets us edit again
+                await asyncio.sleep(e.value)
+                self._changed.set()
+                continue
+            except Exception as e:
+                # Partial markdown or an unchanged message; the final edit fixes it
+                print(f"⚠️ Progressive edit failed: {e}")
+            self._shown = text
+            await asyncio.sleep(self.interval)
+    
+    async def stop(self):
+        """Stop progressive edits (before the final edit)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
 def get_message(key: str, lang="hindi") -> str:
     """
     Get a message in specified language
@@ -189,15 +264,43 @@ def format_stats_message(stats: dict, uptime: str):
     """
     Format stats message for /stats command
     """
-    return f"""📊 **Bot Statistics**
+    msg = f"""📊 **Bot Statistics**
 
 👥 Total Users: {stats.get('total_users', 0)}
 👥 Total Groups: {stats.get('total_groups', 0)}
 📝 Total Queries: {stats.get('total_queries', 0)}
+📈 Queries (24h): {stats.get('queries_24h', 0)}
 🔥 Daily Active Users: {stats.get('daily_active_users', 0)}
 ⏱️ Uptime: {uptime}
-
-— NEET AI Bot"""
+"""
+    
+    top_commands = stats.get('top_commands')
+    if top_commands:
+        msg += "\n**⌨️ Top Commands (today):**\n"
+        for cmd, count in top_commands:
+            msg += f"• {cmd}: {count}\n"
+    
+    top_groups = stats.get('top_groups')
+    if top_groups:
+        msg += "\n**👥 Top Groups (today):**\n"
+        for title, count in top_groups:
+            msg += f"• {title}: {count}\n"
+    
+    caches = stats.get('caches')
+    if caches:
+        msg += "\n**🧠 Caches:**\n"
+        for name, cache in caches.items():
+            msg += (f"• {name}: {cache.get('size', 0)} entries, "
+                    f"{cache.get('hit_rate', 0):.0%} hits "
+                    f"({cache.get('hits', 0)}/{cache.get('hits', 0) + cache.get('misses', 0)})\n")
+    
+    api = stats.get('api')
+    if api:
+        msg += "\n**🌐 API:**\n"
+        for name, value in api.items():
+            msg += f"• {name}: {value}\n"
+    
+    return msg + "\n— NEET AI Bot"
 
 def format_admin_list(admins: list, user_details: dict):
     """
@@ -216,15 +319,16 @@ def format_admin_list(admins: list, user_details: dict):
     
     return msg
 
-def format_group_list(groups: list):
+def format_group_list(groups: list, start: int = 1):
     """
     Format group list message
+    `start` is the number of the first group (for paged lists)
     """
     if not groups:
         return "❌ Bot किसी group में नहीं है।"
     
     msg = "📋 **Bot Groups:**\n\n"
-    for idx, group in enumerate(groups, 1):
+    for idx, group in enumerate(groups, start):
         title = group.get('title', 'Unknown')
         username = group.get('username', 'No username')
         gid = group.get('gid')